@@ -1,10 +1,14 @@
+import asyncio
+import io
 import json
+import mimetypes
 import os
-from base64 import b64decode
+from base64 import b64decode, b64encode
 
 import pytest
 from fastapi.testclient import TestClient
 from prepline_test_project.api.app import app
+import prepline_test_project.api.process_file_1 as process_file_1
 from requests_toolbelt.multipart import decoder
 
 from functions_and_variables import (
@@ -1123,3 +1127,179 @@ def test_supported_mimetypes():
         files=convert_files_for_api([FILE_DOCX]),
     )
     assert response.status_code == 200
+
+
+def test_gzip_file_spooled_to_disk(monkeypatch):
+    monkeypatch.setenv("UNSTRUCTURED_GZIP_SPOOL_MAX_SIZE", "1")
+    for endpoint in PROCESS_FILE_2_ROUTE:
+        response = client.post(
+            endpoint,
+            files=convert_files_for_api([GZIP_FILE_DOCX]),
+            **generate_header_kwargs(JSON),
+        )
+        assert response.status_code == 200
+        _assert_response_for_process_file_2([GZIP_FILE_DOCX], response, JSON)
+
+
+def test_gzip_file_over_max_size(monkeypatch):
+    max_size = FILENAME_LENGTHS[FILE_DOCX] - 1
+    monkeypatch.setenv("UNSTRUCTURED_GZIP_MAX_SIZE", str(max_size))
+    for endpoint in PROCESS_FILE_2_ROUTE:
+        response = client.post(
+            endpoint,
+            files=convert_files_for_api([GZIP_FILE_DOCX]),
+            **generate_header_kwargs(JSON),
+        )
+        assert response.status_code == 413
+        assert response.json()["detail"] == (
+            f"Unable to process {GZIP_FILE_DOCX}: Uncompressed size exceeds {max_size} bytes."
+        )
+
+
+def test_multipart_mixed_response_sends_parts_in_slices(monkeypatch):
+    monkeypatch.setattr(process_file_1.MultipartMixedResponse, "PART_BODY_CHUNK_SIZE", 4)
+    chunks = [b"0123456789", b"abc"]
+
+    async def body_iterator():
+        for chunk in chunks:
+            yield chunk
+
+    response = process_file_1.MultipartMixedResponse(body_iterator())
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response.stream_response(send))
+
+    bodies = [message["body"] for message in messages[1:]]
+    assert max(len(body) for body in bodies if body.isalnum()) == 4
+    assert b"".join(bodies) == b"".join(response.build_part(chunk) for chunk in chunks)
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+@pytest.mark.parametrize("text", ["", "a", "ab", "abc", "abcdefg", "ünïcødé text" * 3])
+def test_multipart_mixed_response_encodes_text_in_slices(monkeypatch, text):
+    monkeypatch.setattr(process_file_1.MultipartMixedResponse, "PART_BODY_CHUNK_SIZE", 8)
+
+    async def body_iterator():
+        yield text
+
+    response = process_file_1.MultipartMixedResponse(body_iterator())
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response.stream_response(send))
+
+    bodies = [message["body"] for message in messages[2:-2]]
+    assert all(len(body) <= 8 for body in bodies)
+    encoded_text = b64encode(text.encode())
+    assert b"".join(bodies) == encoded_text
+    assert b"".join(message["body"] for message in messages[1:]) == response.build_part(
+        encoded_text
+    )
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "fake-doc.docx",
+        "FAKE-TEXT.TXT",
+        "archive.tar.gz",
+        "archive.tgz",
+        "some/path/data.json.gz",
+        "report.v2.pdf",
+        "no-extension",
+        ".bashrc",
+    ],
+)
+def test_guess_mimetype_matches_mimetypes(filename):
+    type_suffix = process_file_1.get_type_suffix(filename)
+    assert process_file_1.guess_mimetype(type_suffix) == mimetypes.guess_type(filename)[0]
+
+
+def test_get_allowed_mimetypes_is_cached():
+    allowed_mimetypes_str = "application/pdf,text/plain"
+    allowed_mimetypes = process_file_1.get_allowed_mimetypes(allowed_mimetypes_str)
+    assert allowed_mimetypes == frozenset(["application/pdf", "text/plain"])
+    assert process_file_1.get_allowed_mimetypes(allowed_mimetypes_str) is allowed_mimetypes
+
+
+def test_mimetypes_are_initialized_on_startup(mocker):
+    init = mocker.patch.object(process_file_1.mimetypes, "init")
+    with TestClient(app):
+        assert init.called
+
+
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def _read_fixture(filename):
+    files_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+    with open(os.path.join(files_path, filename), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize(
+    "data, expected_mimetype",
+    [
+        (_read_fixture(FILE_DOCX), DOCX_MIMETYPE),
+        (_read_fixture(FILE_IMAGE), "image/jpeg"),
+        (_read_fixture(GZIP_FILE_DOCX), "application/gzip"),
+        (b"%PDF-1.7\n", "application/pdf"),
+        (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+        (b"II*\x00\x08\x00", "image/tiff"),
+        (b"MM\x00*\x00\x08", "image/tiff"),
+        (b"PK\x03\x04\x14\x00mimetypeapplication/epub+zip", "application/zip"),
+        (b"{\\rtf1\\ansi", "application/rtf"),
+        (b"\xef\xbb\xbf\n  <!DOCTYPE html><html></html>", "text/html"),
+        (b"<HTML><body></body></HTML>", "text/html"),
+        (
+            b"From sender@example.com Sat Apr  1 00:00:00 2023\n"
+            b"Received: from mail.example.com\n\tby mx.example.com\n"
+            b"From: sender@example.com\nSubject: Hi\n\nBody",
+            "message/rfc822",
+        ),
+        (b"Subject: Not enough headers\n\nBody", None),
+        (b"Title: A markdown heading\nAuthor: Me\n\nBody", None),
+        (b"this is the test text file", None),
+        (b"", None),
+    ],
+)
+def test_sniff_mimetype(data, expected_mimetype):
+    file = io.BytesIO(b"--" + data)
+    file.seek(2)
+    assert process_file_1.sniff_mimetype(file) == expected_mimetype
+    assert file.tell() == 2
+
+
+def test_sniff_mimetype_reads_only_the_start_of_the_file():
+    file = io.BytesIO(b"x" * (process_file_1.SNIFF_SIZE + 1) + b"%PDF-")
+    read = []
+    original_read = file.read
+
+    def mock_read(size=-1):
+        read.append(size)
+        return original_read(size)
+
+    file.read = mock_read
+    assert process_file_1.sniff_mimetype(file) is None
+    assert read == [process_file_1.SNIFF_SIZE]
+
+
+def test_process_file_1_sniffs_octet_stream_without_extension():
+    for endpoint in PROCESS_FILE_1_ROUTE:
+        response = client.post(
+            endpoint,
+            files=[
+                (
+                    "files",
+                    ("fake", io.BytesIO(_read_fixture(FILE_DOCX)), "application/octet-stream"),
+                )
+            ],
+        )
+        assert response.status_code == 200
+        silly_result = response.json()["silly_result"].split(" : ")
+        assert silly_result[:3] == [str(FILENAME_LENGTHS[FILE_DOCX]), "fake", DOCX_MIMETYPE]
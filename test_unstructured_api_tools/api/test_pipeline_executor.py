@@ -0,0 +1,466 @@
+import asyncio
+import base64
+import datetime
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import io
+import json
+import os
+import threading
+import time
+
+import fastapi.routing
+import pytest
+from fastapi.testclient import TestClient
+from requests_toolbelt.multipart import decoder
+from prepline_test_project.api.app import app
+import prepline_test_project.api.process_file_2 as process_file_2
+import prepline_test_project.api.process_text_1 as process_text_1
+import prepline_test_project.api.process_text_file_1 as process_text_file_1
+
+from test_unstructured_api_tools.api.functions_and_variables import (
+    FILE_DOCX,
+    FILE_TXT_1,
+    FILE_TXT_2,
+    FILENAME_LENGTHS,
+    convert_files_for_api,
+    convert_text_files_for_api,
+)
+
+PROCESS_FILE_2_ROUTE = "/test-project/v1.2.3/process-file-2"
+PROCESS_TEXT_1_ROUTE = "/test-project/v1.2.3/process-text-1"
+PROCESS_TEXT_FILE_1_ROUTE = "/test-project/v1.2.3/process-text-file-1"
+
+
+@pytest.fixture
+def pipeline_module(monkeypatch):
+    monkeypatch.setenv("PIPELINE_EXECUTOR", "thread")
+    monkeypatch.delenv("PIPELINE_RESPONSE_CACHE", raising=False)
+    monkeypatch.setattr(process_text_1, "_pipeline_executor", None)
+    monkeypatch.setattr(process_text_1, "_pipeline_semaphores", {})
+    yield process_text_1
+    if process_text_1._pipeline_executor is not None:
+        process_text_1._pipeline_executor.shutdown()
+
+
+def test_run_pipeline_api_bounds_concurrency(pipeline_module, monkeypatch):
+    monkeypatch.setenv("PIPELINE_MAX_WORKERS", "4")
+    monkeypatch.setenv("PIPELINE_MAX_CONCURRENCY", "2")
+    lock = threading.Lock()
+    running = []
+    max_running = []
+    thread_names = set()
+
+    def pipeline_api(text):
+        with lock:
+            running.append(text)
+            max_running.append(len(running))
+            thread_names.add(threading.current_thread().name)
+        time.sleep(0.05)
+        with lock:
+            running.remove(text)
+        return text
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+
+    async def run_all():
+        return await asyncio.gather(*[pipeline_module.run_pipeline_api(str(i)) for i in range(6)])
+
+    assert asyncio.run(run_all()) == [str(i) for i in range(6)]
+    assert max(max_running) == 2
+    assert all(name.startswith("pipeline_api") for name in thread_names)
+
+
+def test_route_runs_pipeline_api_in_executor(pipeline_module, monkeypatch):
+    thread_names = []
+
+    def pipeline_api(text):
+        thread_names.append(threading.current_thread().name)
+        return {"silly_result": text}
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(PROCESS_TEXT_1_ROUTE, files=convert_text_files_for_api([FILE_TXT_1]))
+
+    assert response.status_code == 200
+    assert len(thread_names) == 1 and thread_names[0].startswith("pipeline_api")
+
+
+@pytest.mark.parametrize(
+    "parallel_files, expected_max_running", [("true", 2), ("false", 1), (None, 1)]
+)
+def test_route_processes_files_in_order(
+    pipeline_module, monkeypatch, parallel_files, expected_max_running
+):
+    if parallel_files is None:
+        monkeypatch.delenv("PIPELINE_PARALLEL_FILES", raising=False)
+    else:
+        monkeypatch.setenv("PIPELINE_PARALLEL_FILES", parallel_files)
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def pipeline_api(text):
+        with lock:
+            running.append(text)
+            max_running.append(len(running))
+        # The first file is the slowest, so it finishes last when the files run in parallel
+        time.sleep(0.15 if len(text) == FILENAME_LENGTHS[FILE_TXT_1] else 0.05)
+        with lock:
+            running.remove(text)
+        return {"length": len(text)}
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(
+        PROCESS_TEXT_1_ROUTE,
+        files=convert_text_files_for_api([FILE_TXT_1, FILE_TXT_2]),
+        headers={"Accept": "application/json"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"length": FILENAME_LENGTHS[FILE_TXT_1]},
+        {"length": FILENAME_LENGTHS[FILE_TXT_2]},
+    ]
+    assert max(max_running) == expected_max_running
+
+
+def test_route_awaits_async_pipeline_api(pipeline_module, monkeypatch):
+    async def pipeline_api(text):
+        await asyncio.sleep(0)
+        return {"length": len(text)}
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(PROCESS_TEXT_1_ROUTE, files=convert_text_files_for_api([FILE_TXT_1]))
+
+    assert response.status_code == 200
+    assert response.json() == {"length": FILENAME_LENGTHS[FILE_TXT_1]}
+
+
+def test_route_streams_generator_as_json_array(pipeline_module, monkeypatch):
+    thread_names = []
+
+    def pipeline_api(text):
+        for i in range(3):
+            thread_names.append(threading.current_thread().name)
+            yield {"element": i}
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(
+        PROCESS_TEXT_1_ROUTE,
+        files=convert_text_files_for_api([FILE_TXT_1]),
+        headers={"Accept": "application/json"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == [{"element": 0}, {"element": 1}, {"element": 2}]
+    assert len(thread_names) == 3
+    assert all(name.startswith("pipeline_api") for name in thread_names)
+
+
+def test_route_streams_async_generator_as_parts(pipeline_module, monkeypatch):
+    async def pipeline_api(text):
+        yield {"element": 0}
+        yield "element 1"
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(
+        PROCESS_TEXT_1_ROUTE,
+        files=convert_text_files_for_api([FILE_TXT_1, FILE_TXT_2]),
+        headers={"Accept": "multipart/mixed"},
+    )
+
+    assert response.status_code == 200
+    parts = decoder.MultipartDecoder.from_response(response).parts
+    contents = [base64.b64decode(part.content).decode() for part in parts]
+    assert [json.loads(content) for content in contents[::2]] == [{"element": 0}] * 2
+    assert contents[1::2] == ["element 1"] * 2
+
+
+def test_route_collects_generators_for_multiple_files(pipeline_module, monkeypatch):
+    def pipeline_api(text):
+        yield len(text)
+        yield text[0]
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(
+        PROCESS_TEXT_1_ROUTE,
+        files=convert_text_files_for_api([FILE_TXT_1, FILE_TXT_2]),
+        headers={"Accept": "application/json"},
+    )
+
+    assert response.status_code == 200
+    assert [elements[0] for elements in response.json()] == [
+        FILENAME_LENGTHS[FILE_TXT_1],
+        FILENAME_LENGTHS[FILE_TXT_2],
+    ]
+
+
+def test_process_workers_send_generator_elements_as_list(monkeypatch):
+    def pipeline_api(file):
+        yield from file.read()
+
+    monkeypatch.setattr(process_file_2, "pipeline_api", pipeline_api)
+    file_bytes = process_file_2.FileBytes(b"ab")
+    assert process_file_2._run_pipeline_api_in_process(file_bytes) == [97, 98]
+
+
+@pytest.mark.parametrize("is_generator", [False, True])
+def test_route_streams_ndjson_elements_for_single_file(pipeline_module, monkeypatch, is_generator):
+    def pipeline_api(text):
+        elements = [{"element": i} for i in range(3)]
+        return (element for element in elements) if is_generator else elements
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    response = client.post(
+        PROCESS_TEXT_1_ROUTE,
+        files=convert_text_files_for_api([FILE_TXT_1]),
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    assert response.text.endswith("\n")
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"element": 0},
+        {"element": 1},
+        {"element": 2},
+    ]
+
+
+def test_route_returns_error_status_for_ndjson(pipeline_module, monkeypatch):
+    monkeypatch.setenv("UNSTRUCTURED_ALLOWED_MIMETYPES", "application/pdf")
+    client = TestClient(app)
+    response = client.post(
+        PROCESS_TEXT_1_ROUTE,
+        files=convert_text_files_for_api([FILE_TXT_1]),
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 400
+
+
+def test_route_skips_jsonable_encoder_for_json_native_results(pipeline_module, monkeypatch, mocker):
+    monkeypatch.setattr(pipeline_module, "pipeline_api", lambda text: {"elements": [text[:4]]})
+    jsonable_encoder = mocker.spy(fastapi.routing, "jsonable_encoder")
+    client = TestClient(app)
+    response = client.post(PROCESS_TEXT_1_ROUTE, files=convert_text_files_for_api([FILE_TXT_1]))
+
+    assert response.status_code == 200
+    assert response.json() == {"elements": ["this"]}
+    assert jsonable_encoder.call_count == 0
+
+
+def test_route_encodes_other_results_with_jsonable_encoder(pipeline_module, monkeypatch):
+    monkeypatch.setattr(
+        pipeline_module, "pipeline_api", lambda text: {"date": datetime.date(2023, 4, 1)}
+    )
+    client = TestClient(app)
+    response = client.post(PROCESS_TEXT_1_ROUTE, files=convert_text_files_for_api([FILE_TXT_1]))
+
+    assert response.status_code == 200
+    assert response.json() == {"date": "2023-04-01"}
+
+
+@pytest.fixture
+def cached_pipeline_module(pipeline_module, monkeypatch, tmpdir):
+    monkeypatch.setenv("PIPELINE_RESPONSE_CACHE_DIR", str(tmpdir))
+    monkeypatch.setattr(pipeline_module, "_response_cache", None)
+    calls = []
+
+    def pipeline_api(text):
+        calls.append(text)
+        return {"silly_result": text}
+
+    monkeypatch.setattr(pipeline_module, "pipeline_api", pipeline_api)
+    yield pipeline_module, calls
+
+
+def post_text_files(filenames, **kwargs):
+    client = TestClient(app)
+    return client.post(PROCESS_TEXT_1_ROUTE, files=convert_text_files_for_api(filenames), **kwargs)
+
+
+@pytest.mark.parametrize("cache_type", ["memory", "disk"])
+def test_route_serves_cached_responses(cached_pipeline_module, monkeypatch, cache_type):
+    pipeline_module, calls = cached_pipeline_module
+    monkeypatch.setenv("PIPELINE_RESPONSE_CACHE", cache_type)
+
+    response = post_text_files([FILE_TXT_1])
+    cached_response = post_text_files([FILE_TXT_1])
+    assert len(calls) == 1
+    assert cached_response.status_code == 200
+    assert cached_response.content == response.content
+    assert cached_response.headers["content-type"] == response.headers["content-type"]
+
+    # Other files, other Accept headers and streamed responses are not served from the cache
+    post_text_files([FILE_TXT_2])
+    post_text_files([FILE_TXT_1], headers={"Accept": "application/x-ndjson"})
+    post_text_files([FILE_TXT_1], headers={"Accept": "multipart/mixed"})
+    post_text_files([FILE_TXT_1], headers={"Accept": "multipart/mixed"})
+    assert len(calls) == 5
+
+
+def test_disk_response_cache_persists(cached_pipeline_module, monkeypatch):
+    pipeline_module, calls = cached_pipeline_module
+    monkeypatch.setenv("PIPELINE_RESPONSE_CACHE", "disk")
+    post_text_files([FILE_TXT_1])
+    monkeypatch.setattr(pipeline_module, "_response_cache", None)
+    post_text_files([FILE_TXT_1])
+    assert len(calls) == 1
+
+
+def test_route_validates_mimetypes_of_cached_responses(cached_pipeline_module, monkeypatch):
+    pipeline_module, calls = cached_pipeline_module
+    monkeypatch.setenv("PIPELINE_RESPONSE_CACHE", "memory")
+    assert post_text_files([FILE_TXT_1]).status_code == 200
+
+    monkeypatch.setenv("UNSTRUCTURED_ALLOWED_MIMETYPES", "application/pdf")
+    assert post_text_files([FILE_TXT_1]).status_code == 400
+
+
+def test_route_does_not_validate_text_files_of_cached_responses(monkeypatch):
+    monkeypatch.setenv("PIPELINE_RESPONSE_CACHE", "memory")
+    monkeypatch.setenv("UNSTRUCTURED_ALLOWED_MIMETYPES", "application/pdf")
+    monkeypatch.setenv("PIPELINE_EXECUTOR", "thread")
+    monkeypatch.setattr(process_text_file_1, "_pipeline_executor", None)
+    monkeypatch.setattr(process_text_file_1, "_response_cache", None)
+    calls = []
+
+    def pipeline_api(text, file=None, filename=None, file_content_type=None):
+        calls.append(text)
+        return {"silly_result": text}
+
+    monkeypatch.setattr(process_text_file_1, "pipeline_api", pipeline_api)
+    client = TestClient(app)
+    # The route only validates the mimetypes of files, so a text/plain text file is accepted
+    # whether or not its response is cached
+    for _ in range(2):
+        response = client.post(
+            PROCESS_TEXT_FILE_1_ROUTE, files=convert_text_files_for_api([FILE_TXT_1])
+        )
+        assert response.status_code == 200
+    assert len(calls) == 1
+    process_text_file_1.stop_pipeline_executor()
+
+
+def test_memory_response_cache_evicts_least_recently_used(pipeline_module):
+    response_cache = pipeline_module.MemoryResponseCache(max_size=6)
+    response_cache.set("a", "text/plain", b"aaa")
+    response_cache.set("b", "text/plain", b"bbb")
+    assert response_cache.get("a") == ("text/plain", b"aaa")
+    response_cache.set("c", "text/plain", b"ccc")
+    response_cache.set("d", "text/plain", b"too big")
+
+    assert response_cache.get("b") is None
+    assert response_cache.get("d") is None
+    assert response_cache.get("c") == ("text/plain", b"ccc")
+    assert response_cache.size == 6
+
+
+def test_disk_response_cache_evicts_least_recently_used(pipeline_module, tmpdir):
+    # Each entry takes 14 bytes, and eviction goes down to 90% of max_size
+    response_cache = pipeline_module.DiskResponseCache(str(tmpdir), max_size=32)
+    response_cache.set("a", "text/plain", b"aaa")
+    response_cache.set("b", "text/plain", b"bbb")
+    os.utime(os.path.join(tmpdir, "a"), (0, 0))
+    os.utime(os.path.join(tmpdir, "b"), (1, 1))
+    assert response_cache.get("a") == ("text/plain", b"aaa")
+    response_cache.set("c", "text/plain", b"ccc")
+
+    assert response_cache.get("b") is None
+    assert sorted(os.listdir(tmpdir)) == ["a", "c"]
+    assert response_cache.size == 28
+
+
+def test_disk_response_cache_only_scans_when_full(pipeline_module, tmpdir, mocker):
+    response_cache = pipeline_module.DiskResponseCache(str(tmpdir), max_size=32)
+    evict = mocker.spy(response_cache, "evict")
+    response_cache.set("a", "text/plain", b"aaa")
+    response_cache.set("b", "text/plain", b"bbb")
+    assert evict.call_count == 0
+    response_cache.set("c", "text/plain", b"ccc")
+    assert evict.call_count == 1
+
+
+def test_disk_response_cache_removes_temporary_file_on_error(pipeline_module, tmpdir, mocker):
+    response_cache = pipeline_module.DiskResponseCache(str(tmpdir), max_size=32)
+    mocker.patch.object(pipeline_module.os, "replace", side_effect=OSError("Squawk!"))
+    with pytest.raises(OSError):
+        response_cache.set("a", "text/plain", b"aaa")
+    assert os.listdir(tmpdir) == []
+
+
+def test_get_file_digest_rewinds_the_file(pipeline_module, monkeypatch):
+    monkeypatch.setattr(pipeline_module, "RESPONSE_CACHE_CHUNK_SIZE", 3)
+    file = pipeline_module.UploadFile(file=io.BytesIO(b"--silly"), filename="silly.txt")
+    file.file.seek(2)
+    assert pipeline_module.get_file_digest(file) == hashlib.sha256(b"silly").hexdigest()
+    assert file.file.tell() == 2
+
+
+@pytest.fixture
+def process_pipeline_module(monkeypatch):
+    monkeypatch.setenv("PIPELINE_EXECUTOR", "process")
+    monkeypatch.setenv("PIPELINE_MAX_WORKERS", "2")
+    monkeypatch.setattr(process_file_2, "_pipeline_executor", None)
+    monkeypatch.setattr(process_file_2, "_pipeline_semaphores", {})
+    yield process_file_2
+    process_file_2.stop_pipeline_executor()
+
+
+def test_route_runs_pipeline_api_in_process_pool(process_pipeline_module, monkeypatch):
+    monkeypatch.setattr(process_text_1, "_pipeline_executor", None)
+    with TestClient(app) as client:
+        # Pools are only started by the first call to their pipeline
+        assert process_pipeline_module._pipeline_executor is None
+        response = client.post(PROCESS_FILE_2_ROUTE, files=convert_files_for_api([FILE_DOCX]))
+        assert isinstance(process_pipeline_module._pipeline_executor, ProcessPoolExecutor)
+        assert process_text_1._pipeline_executor is None
+
+    assert response.status_code == 200
+    assert response.json() == {"silly_result": str(FILENAME_LENGTHS[FILE_DOCX])}
+    assert process_pipeline_module._pipeline_executor is None
+
+
+def test_process_pool_is_recycled(process_pipeline_module, monkeypatch):
+    monkeypatch.setenv("PIPELINE_WORKER_MAX_TASKS", "1")
+
+    async def run_pipeline_api():
+        return await process_pipeline_module.run_pipeline_api(io.BytesIO(b"four"))
+
+    executors = []
+    for _ in range(3):
+        assert asyncio.run(run_pipeline_api()) == {"silly_result": "4"}
+        executors.append(process_pipeline_module._pipeline_executor)
+
+    # Two workers with one task each, so the third call gets a new pool
+    assert executors[0] is executors[1]
+    assert executors[2] is not executors[0]
+
+
+class SlowFile(io.BytesIO):
+    def read(self, *args):
+        time.sleep(0.5)
+        return super().read(*args)
+
+
+def test_process_pool_is_recycled_during_concurrent_calls(process_pipeline_module, monkeypatch):
+    monkeypatch.setenv("PIPELINE_MAX_WORKERS", "1")
+    monkeypatch.setenv("PIPELINE_WORKER_MAX_TASKS", "1")
+    monkeypatch.setenv("PIPELINE_MAX_CONCURRENCY", "2")
+
+    async def run_pipeline_apis():
+        # The second call replaces the pool while the first one is still reading its file
+        return await asyncio.gather(
+            process_pipeline_module.run_pipeline_api(SlowFile(b"four")),
+            process_pipeline_module.run_pipeline_api(io.BytesIO(b"three")),
+        )
+
+    assert asyncio.run(run_pipeline_apis()) == [{"silly_result": "4"}, {"silly_result": "5"}]
@@ -1,11 +1,18 @@
+import asyncio
+import io
 import json
 import os
+import sys
 from base64 import b64decode
 
 import pytest
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.testclient import TestClient
+import pandas as pd
 from prepline_test_project.api.app import app
 from requests_toolbelt.multipart import decoder
+import prepline_test_project.api.process_text_4 as process_text_4
 
 from test_unstructured_api_tools.api.functions_and_variables import (
     FILE_TXT_1,
@@ -558,3 +565,118 @@ def test_process_text_4(
             _assert_response_for_process_text_4(
                 test_files, response, response_type, response_schema
             )
+
+
+def _csv_response(data):
+    return PlainTextResponse(pd.DataFrame(data).to_csv())
+
+
+def _merge_csv_responses(responses):
+    data = pd.read_csv(io.BytesIO(responses[0].body))
+    for response in responses[1:]:
+        data = data.merge(pd.read_csv(io.BytesIO(response.body)), how="outer")
+    return data.to_csv()
+
+
+@pytest.mark.parametrize(
+    "responses",
+    [
+        [
+            _csv_response({"text": ["b", "a"], "n": [2, 1]}),
+            _csv_response({"text": ["a", "c"], "n": [1, 3]}),
+            _csv_response({"text": ["z"], "n": [0]}),
+        ],
+        [
+            _csv_response({"text": ["b", "a"], "n": [2, 1]}),
+            _csv_response({"text": ["b", "c"], "m": [3, 4]}),
+        ],
+        [
+            PlainTextResponse("x,y\n1,a\n1,a\n2,b\n"),
+            PlainTextResponse("x,y\n1,a\n3,c\n"),
+            PlainTextResponse("x,y\n1,a\n1,a\n3,c\n3,c\n"),
+        ],
+        [
+            PlainTextResponse("x,y\n1,\n1,\n2,b\n"),
+            PlainTextResponse("x,y\n1,\n2,b\n2,b\n"),
+        ],
+    ],
+)
+def test_join_csv_responses_matches_merge(responses):
+    joined = process_text_4.join_csv_responses(responses)
+    assert joined.body.decode() == _merge_csv_responses(responses)
+
+
+def test_join_csv_responses_without_pandas(monkeypatch):
+    responses = [_csv_response({"text": ["a"]})]
+    monkeypatch.setitem(sys.modules, "pandas", None)
+    with pytest.raises(HTTPException) as exc_info:
+        process_text_4.join_csv_responses(responses)
+    assert exc_info.value.status_code == 500
+
+
+def test_process_text_4_joins_csv_responses_off_the_event_loop(monkeypatch):
+    monkeypatch.delenv("PIPELINE_RESPONSE_CACHE", raising=False)
+    join_csv_responses = process_text_4.join_csv_responses
+    calls = []
+
+    def spy_join_csv_responses(responses):
+        try:
+            asyncio.get_running_loop()
+            calls.append("event loop")
+        except RuntimeError:
+            calls.append("threadpool")
+        return join_csv_responses(responses)
+
+    monkeypatch.setattr(process_text_4, "join_csv_responses", spy_join_csv_responses)
+    response = client.post(
+        PROCESS_TEXT_4_ROUTE[0],
+        files=convert_text_files_for_api([FILE_TXT_1, FILE_TXT_2]),
+        data={**RESPONSE_SCHEMA_ISD, "output_format": TEXT_CSV},
+        **generate_header_kwargs(TEXT_CSV),
+    )
+    assert response.status_code == 200
+    assert calls == ["threadpool"]
+
+
+def test_process_text_4_ndjson():
+    for endpoint in PROCESS_TEXT_4_ROUTE:
+        response = client.post(
+            endpoint,
+            files=convert_text_files_for_api([FILE_TXT_1, FILE_TXT_2]),
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = response.text.splitlines()
+        assert len(lines) == 2
+        for line, filename in zip(lines, [FILE_TXT_1, FILE_TXT_2]):
+            silly_result = json.loads(line)["silly_result"].split(" : ")
+            assert silly_result[0] == str(FILENAME_LENGTHS[filename])
+            assert silly_result[-2:] == ["application/json", "isd"]
+
+
+@pytest.mark.parametrize(
+    "value", [{"a": [1, 2.5, None, "ü"]}, [{"b": True}], {1: "non str key"}, 2**70]
+)
+def test_json_dumps_with_orjson(monkeypatch, value):
+    monkeypatch.setenv("PIPELINE_JSON_ENCODER", "orjson")
+    assert json.loads(process_text_4.json_dumps(value)) == json.loads(json.dumps(value))
+    assert json.loads(process_text_4.PipelineJSONResponse(value).body) == json.loads(
+        json.dumps(value)
+    )
+
+
+def test_json_dumps_uses_orjson_only_when_selected(monkeypatch, mocker):
+    monkeypatch.delenv("PIPELINE_JSON_ENCODER", raising=False)
+    value = {"text": "silly"}
+    orjson_dumps = mocker.spy(process_text_4.orjson, "dumps")
+    process_text_4.json_dumps(value)
+    assert orjson_dumps.call_count == 0
+
+    monkeypatch.setenv("PIPELINE_JSON_ENCODER", "orjson")
+    assert process_text_4.json_dumps(value) == '{"text":"silly"}'
+    assert orjson_dumps.call_count == 1
+
+    monkeypatch.setattr(process_text_4, "orjson", None)
+    assert process_text_4.json_dumps(value) == json.dumps(value)
+    assert process_text_4.PipelineJSONResponse(value).body == JSONResponse(value).body
@@ -3,24 +3,488 @@
 # DO NOT MODIFY DIRECTLY
 #####################################################################
 
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import hashlib
+import inspect
 import io
 import os
 import gzip
 import mimetypes
-from typing import List, Union
+import tempfile
+import threading
+from typing import Any, FrozenSet, List, Union
+import weakref
 from fastapi import status, FastAPI, File, Form, Request, UploadFile, APIRouter, HTTPException
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 import json
 from fastapi.responses import StreamingResponse
 from starlette.datastructures import Headers
 from starlette.types import Send
 from base64 import b64encode
-from typing import Optional, Mapping
+from typing import Optional, Mapping, Iterator, Tuple
 import secrets
 
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
 app = FastAPI()
 router = APIRouter()
 
+# Uncompressed gzip uploads are kept in memory up to UNSTRUCTURED_GZIP_SPOOL_MAX_SIZE bytes
+# and spooled to a temporary file beyond that. Uploads that uncompress to more than
+# UNSTRUCTURED_GZIP_MAX_SIZE bytes are rejected.
+DEFAULT_GZIP_SPOOL_MAX_SIZE = 10 * 1024 * 1024
+DEFAULT_GZIP_MAX_SIZE = 1024 * 1024 * 1024
+GZIP_CHUNK_SIZE = 1024 * 1024
+
+# pipeline_api runs in a dedicated pool of PIPELINE_MAX_WORKERS workers, so that busy pipelines
+# do not hold up the threads that serve other requests such as the healthcheck. At most
+# PIPELINE_MAX_CONCURRENCY calls are submitted to the pool at a time, the others wait on the
+# event loop. With PIPELINE_EXECUTOR=process the workers are processes instead of threads, which
+# lets CPU bound pipelines use more than one core. Every pipeline in the app has its own pool,
+# which is only started on its first call, so that pipelines that are not used do not start any
+# workers. Worker processes are replaced after PIPELINE_WORKER_MAX_TASKS calls per worker if it
+# is set.
+
+PIPELINE_EXECUTOR_TYPES = ["thread", "process"]
+
+_pipeline_executor: Optional[Executor] = None
+_pipeline_executor_tasks = 0
+_pipeline_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_pipeline_executor_type() -> str:
+    executor_type = os.environ.get("PIPELINE_EXECUTOR", "thread")
+    return executor_type if executor_type in PIPELINE_EXECUTOR_TYPES else "thread"
+
+
+def get_pipeline_max_workers() -> int:
+    if get_pipeline_executor_type() == "process":
+        default_max_workers = os.cpu_count() or 1
+    else:
+        # The default size of a ThreadPoolExecutor
+        default_max_workers = min(32, (os.cpu_count() or 1) + 4)
+    return int(os.environ.get("PIPELINE_MAX_WORKERS", default_max_workers))
+
+
+def get_pipeline_executor() -> Executor:
+    """Returns the executor for pipeline_api calls. The executor is created on first use, and
+    a process pool is replaced once its workers have run PIPELINE_WORKER_MAX_TASKS calls."""
+    global _pipeline_executor, _pipeline_executor_tasks
+    max_tasks = int(os.environ.get("PIPELINE_WORKER_MAX_TASKS", 0))
+    worn_out = max_tasks and _pipeline_executor_tasks >= max_tasks * get_pipeline_max_workers()
+    if isinstance(_pipeline_executor, ProcessPoolExecutor) and worn_out:
+        # Calls that were already submitted still run to completion
+        _pipeline_executor.shutdown(wait=False)
+        _pipeline_executor = None
+
+    if _pipeline_executor is None:
+        _pipeline_executor_tasks = 0
+        if get_pipeline_executor_type() == "process":
+            _pipeline_executor = ProcessPoolExecutor(max_workers=get_pipeline_max_workers())
+        else:
+            _pipeline_executor = ThreadPoolExecutor(
+                max_workers=get_pipeline_max_workers(), thread_name_prefix="pipeline_api"
+            )
+    return _pipeline_executor
+
+
+def get_pipeline_semaphore() -> asyncio.Semaphore:
+    """Returns the semaphore that bounds concurrent pipeline_api calls on the running loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _pipeline_semaphores:
+        max_concurrency = int(
+            os.environ.get("PIPELINE_MAX_CONCURRENCY", get_pipeline_max_workers())
+        )
+        _pipeline_semaphores[loop] = asyncio.Semaphore(max_concurrency)
+    return _pipeline_semaphores[loop]
+
+
+class FileBytes:
+    """The content of a file argument to pipeline_api, sent to a worker process in place of
+    the file object."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+async def _to_process_arg(value):
+    if hasattr(value, "read") and not isinstance(value, (str, bytes)):
+        return FileBytes(await run_in_threadpool(value.read))
+    return value
+
+
+def _from_process_arg(value):
+    return io.BytesIO(value.data) if isinstance(value, FileBytes) else value
+
+
+def _run_pipeline_api_in_process(*args, **kwargs):
+    args = tuple(_from_process_arg(value) for value in args)
+    kwargs = {name: _from_process_arg(value) for name, value in kwargs.items()}
+    response = pipeline_api(*args, **kwargs)
+    # Generators can not be sent back from the worker, so their elements are sent as a list
+    return list(response) if inspect.isgenerator(response) else response
+
+
+def _orjson_dumps(value) -> Optional[bytes]:
+    if orjson is None or os.environ.get("PIPELINE_JSON_ENCODER", "json") != "orjson":
+        return None
+    try:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    except TypeError:
+        # Such as integers that do not fit in 64 bits
+        return None
+
+
+def json_dumps(value) -> str:
+    """Serializes the value to JSON. With PIPELINE_JSON_ENCODER=orjson, orjson is used if it
+    is installed, which is several times faster for large results. Values that orjson can
+    not serialize fall back to json.dumps."""
+    data = _orjson_dumps(value)
+    return json.dumps(value) if data is None else data.decode()
+
+
+class PipelineJSONResponse(JSONResponse):
+    """A JSONResponse that is rendered with orjson when json_dumps would use it."""
+
+    def render(self, content) -> bytes:
+        data = _orjson_dumps(content)
+        return super().render(content) if data is None else data
+
+
+def json_response(content):
+    """Returns JSON native content as a PipelineJSONResponse. FastAPI sends responses as they
+    are, instead of first copying the content with jsonable_encoder. Other content, including
+    lists and dicts with values that json can not serialize, is returned for FastAPI to encode."""
+    if not isinstance(content, (dict, list)):
+        return content
+    try:
+        return PipelineJSONResponse(content)
+    except (TypeError, ValueError):
+        return content
+
+
+async def _iterate_in_executor(generator, executor: Executor):
+    """Runs each step of the generator in the executor, so that the elements are produced
+    without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    done = object()
+    try:
+        while True:
+            async with get_pipeline_semaphore():
+                element = await loop.run_in_executor(executor, next, generator, done)
+            if element is done:
+                return
+            yield element
+    finally:
+        # A step that was cancelled may still be running in the executor
+        if not generator.gi_running:
+            generator.close()
+
+
+async def run_pipeline_api(*args, **kwargs):
+    """Calls pipeline_api in the pipeline executor without blocking the event loop. When the
+    executor is a process pool, file arguments are read and sent to the worker as bytes.
+
+    If pipeline_api is an async def, it runs on the event loop instead. If pipeline_api is a
+    generator, the result is an async generator of its elements."""
+    global _pipeline_executor_tasks
+    if inspect.isasyncgenfunction(pipeline_api):
+        return pipeline_api(*args, **kwargs)
+
+    async with get_pipeline_semaphore():
+        if inspect.iscoroutinefunction(pipeline_api):
+            response = pipeline_api(*args, **kwargs)
+            return await response if inspect.isawaitable(response) else response
+
+        if get_pipeline_executor_type() == "process":
+            args = tuple([await _to_process_arg(value) for value in args])
+            kwargs = {name: await _to_process_arg(value) for name, value in kwargs.items()}
+            func = functools.partial(_run_pipeline_api_in_process, *args, **kwargs)
+        else:
+            func = functools.partial(pipeline_api, *args, **kwargs)
+        # A concurrent call can replace the executor while this one awaits, so the executor is
+        # only looked up once nothing is left to await before submitting to it
+        loop = asyncio.get_running_loop()
+        executor = get_pipeline_executor()
+        _pipeline_executor_tasks += 1
+        response = await loop.run_in_executor(executor, func)
+    return _iterate_in_executor(response, executor) if inspect.isgenerator(response) else response
+
+
+def stream_json_array(elements) -> StreamingResponse:
+    """Streams the elements of an async iterator as a JSON array, one element at a time."""
+
+    async def json_array_chunks():
+        separator = "["
+        async for element in elements:
+            yield separator + json_dumps(element)
+            separator = ","
+        yield "]" if separator == "," else "[]"
+
+    return StreamingResponse(json_array_chunks(), media_type="application/json")
+
+
+async def stream_ndjson(responses, is_single_file: bool) -> StreamingResponse:
+    """Streams the responses as newline delimited JSON. For a single file, each element of a
+    list or streamed result is sent as its own line, otherwise each response is a line."""
+    # Getting the first response before the stream starts lets errors in it, such as an
+    # unsupported file type, still be returned with an error status
+    first_response = await responses.__anext__()
+
+    async def ndjson_lines():
+        response = first_response
+        while True:
+            if is_single_file and inspect.isasyncgen(response):
+                async for element in response:
+                    yield json_dumps(element) + "\n"
+            elif is_single_file and isinstance(response, list):
+                for element in response:
+                    yield json_dumps(element) + "\n"
+            else:
+                yield json_dumps(response) + "\n"
+            try:
+                response = await responses.__anext__()
+            except StopAsyncIteration:
+                return
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+async def iterate_in_order(coroutines):
+    """Yields the results of the coroutines in order. If PIPELINE_PARALLEL_FILES is true, all of
+    the coroutines run concurrently, bounded by PIPELINE_MAX_CONCURRENCY, and each result is
+    yielded as soon as it and the results before it are ready. Otherwise each coroutine only
+    starts once the previous one is done."""
+    if os.environ.get("PIPELINE_PARALLEL_FILES", "false").lower() not in ["true", "1"]:
+        try:
+            for coroutine in coroutines:
+                yield await coroutine
+        finally:
+            # Closing the coroutines that never started avoids "never awaited" warnings
+            for coroutine in coroutines:
+                coroutine.close()
+        return
+
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@router.on_event("shutdown")
+def stop_pipeline_executor():
+    global _pipeline_executor
+    if _pipeline_executor is not None:
+        _pipeline_executor.shutdown()
+        _pipeline_executor = None
+
+
+# With PIPELINE_RESPONSE_CACHE set to memory or disk, responses are cached by the content of the
+# uploaded files and the request parameters, up to PIPELINE_RESPONSE_CACHE_MAX_SIZE bytes of
+# responses. The memory cache belongs to this pipeline, so the limit applies to every pipeline in
+# the app separately. The disk cache is kept in PIPELINE_RESPONSE_CACHE_DIR, and the limit applies
+# to the whole directory, which the pipelines share by default.
+
+RESPONSE_CACHE_TYPES = ["memory", "disk"]
+
+DEFAULT_RESPONSE_CACHE_MAX_SIZE = 32 * 1024 * 1024
+DEFAULT_RESPONSE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pipeline-response-cache")
+RESPONSE_CACHE_CHUNK_SIZE = 1024 * 1024
+RESPONSE_CACHE_EVICT_RATIO = 0.9
+_response_cache: Any = None
+
+
+class MemoryResponseCache:
+    """Keeps the content type and body of the most recently used responses in memory."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, content_type: str, body: bytes):
+        if len(body) > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[1])
+            self.entries[key] = (content_type, body)
+            self.size += len(body)
+            while self.size > self.max_size:
+                _, (_, evicted_body) = self.entries.popitem(last=False)
+                self.size -= len(evicted_body)
+
+
+class DiskResponseCache:
+    """Keeps the content type and body of responses in files named by their keys. Reading an
+    entry refreshes its modification time. Once the files add up to more than max_size bytes,
+    the entries with the oldest modification times are removed until they are back under
+    RESPONSE_CACHE_EVICT_RATIO of max_size, so that the directory is not scanned on every
+    write."""
+
+    TMP_PREFIX = ".tmp-"
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # An estimate of the size of the entries, which other processes and pipelines sharing
+        # the directory also add to. evict recounts it from the files
+        self.size = self.evict()
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        filename = os.path.join(self.directory, key)
+        try:
+            with open(filename, "rb") as f:
+                content_type = f.readline().decode().rstrip("\n")
+                body = f.read()
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        return content_type, body
+
+    def set(self, key: str, content_type: str, body: bytes):
+        head = content_type.encode() + b"\n"
+        if len(head) + len(body) > self.max_size:
+            return
+        # The entry is written to a temporary file first, so that it is never read half written
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix=self.TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(head)
+                f.write(body)
+            os.replace(tmp_filename, os.path.join(self.directory, key))
+        except Exception as e:
+            os.unlink(tmp_filename)
+            raise e
+
+        with self.lock:
+            self.size += len(head) + len(body)
+            if self.size > self.max_size:
+                self.size = self.evict()
+
+    def evict(self) -> int:
+        """Removes the least recently used entries if the files add up to more than max_size
+        bytes, and returns the size of the remaining entries."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(self.TMP_PREFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size <= self.max_size:
+            return size
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size * RESPONSE_CACHE_EVICT_RATIO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        return size
+
+
+def get_response_cache():
+    """Returns the response cache, or None if responses are not cached. The cache is created
+    on first use."""
+    global _response_cache
+    cache_type = os.environ.get("PIPELINE_RESPONSE_CACHE")
+    if cache_type not in RESPONSE_CACHE_TYPES:
+        return None
+
+    if _response_cache is None:
+        max_size = int(
+            os.environ.get("PIPELINE_RESPONSE_CACHE_MAX_SIZE", DEFAULT_RESPONSE_CACHE_MAX_SIZE)
+        )
+        if cache_type == "disk":
+            directory = os.environ.get("PIPELINE_RESPONSE_CACHE_DIR", DEFAULT_RESPONSE_CACHE_DIR)
+            _response_cache = DiskResponseCache(directory, max_size)
+        else:
+            _response_cache = MemoryResponseCache(max_size)
+    return _response_cache
+
+
+def get_file_digest(file: UploadFile) -> str:
+    """Returns the SHA-256 of the content of the file, which is read in chunks and then
+    returned to its position."""
+    position = file.file.tell()
+    sha256 = hashlib.sha256()
+    for chunk in iter(functools.partial(file.file.read, RESPONSE_CACHE_CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    file.file.seek(position)
+    return sha256.hexdigest()
+
+
+async def get_response_cache_key(
+    params: list, files: List[UploadFile], text_files: List[UploadFile] = []
+) -> str:
+    """Returns the cache key for a request with the parameters and the uploaded files. The
+    key covers the name, validated mimetype and content of each file, so files that are not
+    allowed are still rejected when their response is cached. The text_files are the uploads
+    that the route does not validate, and are keyed by the content type they were sent with."""
+    file_keys = [
+        [
+            file.filename,
+            get_validated_mimetype(file),
+            await run_in_threadpool(get_file_digest, file),
+        ]
+        for file in files
+    ]
+    text_file_keys = [
+        [file.filename, file.content_type, await run_in_threadpool(get_file_digest, file)]
+        for file in text_files
+    ]
+    return hashlib.sha256(json.dumps([params, file_keys, text_file_keys]).encode()).hexdigest()
+
+
+async def get_cached_response(cache_key: str) -> Optional[Response]:
+    entry = await run_in_threadpool(get_response_cache().get, cache_key)
+    if entry is None:
+        return None
+    content_type, body = entry
+    return Response(content=body, headers={"content-type": content_type})
+
+
+async def cache_response(cache_key: Optional[str], response):
+    """Stores the response in the response cache if it is cached by the request, and returns
+    it. Only complete responses are stored, not streamed ones or errors."""
+    if cache_key is None or not isinstance(response, Response):
+        return response
+    if isinstance(response, StreamingResponse) or response.status_code != 200:
+        return response
+    await run_in_threadpool(
+        get_response_cache().set, cache_key, response.headers["content-type"], response.body
+    )
+    return response
+
 
 # pipeline-api
 
@@ -43,6 +507,114 @@ def pipeline_api(
     }
 
 
+@functools.lru_cache(maxsize=8)
+def get_allowed_mimetypes(allowed_mimetypes_str: str) -> FrozenSet[str]:
+    return frozenset(allowed_mimetypes_str.split(","))
+
+
+def get_type_suffix(filename: str) -> str:
+    """Returns the last two extensions of the filename, such as .tar.gz, which are all that
+    mimetypes.guess_type looks at."""
+    root, extension = os.path.splitext(os.path.basename(filename))
+    return os.path.splitext(root)[1] + extension
+
+
+@functools.lru_cache(maxsize=1024)
+def guess_mimetype(type_suffix: str) -> Optional[str]:
+    return mimetypes.guess_type(f"file{type_suffix}")[0]
+
+
+@router.on_event("startup")
+def init_mimetypes():
+    # Loads the mimetypes database, which guess_type would otherwise load on the first request
+    mimetypes.init()
+
+
+# The number of bytes at the start of a file that sniff_mimetype looks at
+SNIFF_SIZE = 4096
+# The bytes that files of each type start with
+MIMETYPE_SIGNATURES: List[Tuple[bytes, str]] = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"{\\rtf", "application/rtf"),
+]
+# The directory of the main part of each Office Open XML format, which follows the content
+# types and relationships near the start of the zip file
+OOXML_DIRECTORIES: List[Tuple[bytes, str]] = [
+    (b"word/", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    (b"xl/", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    (b"ppt/", "application/vnd.openxmlformats-officedocument.presentationml.presentation"),
+]
+HTML_PREFIXES = (b"<!doctype html", b"<html", b"<head", b"<body")
+EMAIL_HEADERS = frozenset(
+    [
+        b"cc",
+        b"content-type",
+        b"date",
+        b"delivered-to",
+        b"from",
+        b"message-id",
+        b"mime-version",
+        b"received",
+        b"reply-to",
+        b"return-path",
+        b"subject",
+        b"to",
+        b"x-mailer",
+    ]
+)
+
+
+def _is_email(head: bytes) -> bool:
+    """Returns True if the file starts with a header section that has at least two of the
+    usual email headers."""
+    header_names: List[bytes] = []
+    for line in head.split(b"\n"):
+        line = line.rstrip(b"\r")
+        if not line:
+            break
+        if line[:1] in [b" ", b"\t"] or (not header_names and line.startswith(b"From ")):
+            # Folded header lines, and the From line of mbox files
+            continue
+        name, separator, _ = line.partition(b":")
+        if not separator or not name or b" " in name:
+            break
+        header_names.append(name.lower())
+    return len(EMAIL_HEADERS.intersection(header_names)) >= 2
+
+
+def sniff_mimetype(file) -> Optional[str]:
+    """Returns the mimetype of the file from the bytes it starts with, or None if it is not
+    one of the recognized types. Only the first SNIFF_SIZE bytes are read, and the file is
+    returned to its position afterwards."""
+    try:
+        position = file.tell()
+        head = file.read(SNIFF_SIZE)
+        file.seek(position)
+    except (AttributeError, OSError):
+        return None
+    if not isinstance(head, bytes):
+        return None
+
+    for signature, mimetype in MIMETYPE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    if head.startswith(b"PK\x03\x04"):
+        for directory, mimetype in OOXML_DIRECTORIES:
+            if directory in head:
+                return mimetype
+        return "application/zip"
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").lower().startswith(HTML_PREFIXES):
+        return "text/html"
+    if _is_email(head):
+        return "message/rfc822"
+    return None
+
+
 def get_validated_mimetype(file):
     """
     Return a file's mimetype, either via the file.content_type or the mimetypes lib if that's too
@@ -51,7 +623,7 @@ def get_validated_mimetype(file):
     """
     content_type = file.content_type
     if not content_type or content_type == "application/octet-stream":
-        content_type = mimetypes.guess_type(str(file.filename))[0]
+        content_type = guess_mimetype(get_type_suffix(str(file.filename)))
 
         # Some filetypes missing for this library, just hardcode them for now
         if not content_type:
@@ -60,9 +632,12 @@ def get_validated_mimetype(file):
             elif file.filename.endswith(".msg"):
                 content_type = "message/rfc822"
 
+        if not content_type:
+            content_type = sniff_mimetype(file.file)
+
     allowed_mimetypes_str = os.environ.get("UNSTRUCTURED_ALLOWED_MIMETYPES")
     if allowed_mimetypes_str is not None:
-        allowed_mimetypes = allowed_mimetypes_str.split(",")
+        allowed_mimetypes = get_allowed_mimetypes(allowed_mimetypes_str)
 
         if content_type not in allowed_mimetypes:
             raise HTTPException(
@@ -78,6 +653,8 @@ def get_validated_mimetype(file):
 
 class MultipartMixedResponse(StreamingResponse):
     CRLF = b"\r\n"
+    # Part bodies are sent in ASGI messages of at most this many bytes
+    PART_BODY_CHUNK_SIZE = 64 * 1024
 
     def __init__(self, *args, content_type: str = None, **kwargs):
         super().__init__(*args, **kwargs)
@@ -94,19 +671,44 @@ class MultipartMixedResponse(StreamingResponse):
         return b"--" + self.boundary_value.encode()
 
     def _build_part_headers(self, headers: dict) -> bytes:
-        header_bytes = b""
-        for header, value in headers.items():
-            header_bytes += f"{header}: {value}".encode() + self.CRLF
-        return header_bytes
+        return b"".join(
+            f"{header}: {value}".encode() + self.CRLF for header, value in headers.items()
+        )
 
-    def build_part(self, chunk: bytes) -> bytes:
-        part = self.boundary + self.CRLF
-        part_headers = {"Content-Length": len(chunk), "Content-Transfer-Encoding": "base64"}
+    def build_part_head(self, content_length: int) -> bytes:
+        part_headers = {"Content-Length": content_length, "Content-Transfer-Encoding": "base64"}
         if self.content_type is not None:
             part_headers["Content-Type"] = self.content_type
-        part += self._build_part_headers(part_headers)
-        part += self.CRLF + chunk + self.CRLF
-        return part
+        return b"".join(
+            [self.boundary, self.CRLF, self._build_part_headers(part_headers), self.CRLF]
+        )
+
+    def build_part(self, chunk: bytes) -> bytes:
+        return b"".join([self.build_part_head(len(chunk)), chunk, self.CRLF])
+
+    def iter_part(self, chunk: bytes) -> Iterator[bytes]:
+        """Yields the part for the chunk as the head, the body in slices of at most
+        PART_BODY_CHUNK_SIZE bytes and the closing CRLF, so the body is never copied whole."""
+        yield self.build_part_head(len(chunk))
+        if len(chunk) <= self.PART_BODY_CHUNK_SIZE:
+            yield chunk
+        else:
+            for start in range(0, len(chunk), self.PART_BODY_CHUNK_SIZE):
+                end = start + self.PART_BODY_CHUNK_SIZE
+                yield chunk[start:end]
+        yield self.CRLF
+
+    def iter_base64_part(self, data: bytes) -> Iterator[bytes]:
+        """Like iter_part, but base64 encodes the data one slice at a time. The slices are a
+        multiple of 3 bytes long, so that their encodings join up into the encoding of the
+        whole and only one slice is held encoded at a time."""
+        yield self.build_part_head(4 * ((len(data) + 2) // 3))
+        data_view = memoryview(data)
+        slice_size = self.PART_BODY_CHUNK_SIZE // 4 * 3
+        for start in range(0, len(data), slice_size):
+            end = start + slice_size
+            yield b64encode(data_view[start:end])
+        yield self.CRLF
 
     async def stream_response(self, send: Send) -> None:
         await send(
@@ -117,12 +719,12 @@ class MultipartMixedResponse(StreamingResponse):
             }
         )
         async for chunk in self.body_iterator:
-            if not isinstance(chunk, bytes):
-                chunk = chunk.encode(self.charset)
-                chunk = b64encode(chunk)
-            await send(
-                {"type": "http.response.body", "body": self.build_part(chunk), "more_body": True}
-            )
+            if isinstance(chunk, bytes):
+                part = self.iter_part(chunk)
+            else:
+                part = self.iter_base64_part(chunk.encode(self.charset))
+            for body in part:
+                await send({"type": "http.response.body", "body": body, "more_body": True})
 
         await send({"type": "http.response.body", "body": b"", "more_body": False})
 
@@ -138,18 +740,43 @@ def ungz_file(file: UploadFile, gz_uncompressed_content_type=None) -> UploadFile
     if filename.endswith(".gz"):
         filename = filename[:-3]
 
-    gzip_file = gzip.open(file.file).read()
+    spool_max_size = int(
+        os.environ.get("UNSTRUCTURED_GZIP_SPOOL_MAX_SIZE", DEFAULT_GZIP_SPOOL_MAX_SIZE)
+    )
+    max_size = int(os.environ.get("UNSTRUCTURED_GZIP_MAX_SIZE", DEFAULT_GZIP_MAX_SIZE))
+
+    uncompressed_file = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    size = 0
+    with gzip.open(file.file) as gzip_file:
+        while chunk := gzip_file.read(GZIP_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                uncompressed_file.close()
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=(
+                        f"Unable to process {file.filename}: "
+                        f"Uncompressed size exceeds {max_size} bytes."
+                    ),
+                )
+            uncompressed_file.write(chunk)
+    uncompressed_file.seek(0)
+
     return UploadFile(
-        file=io.BytesIO(gzip_file),
-        size=len(gzip_file),
+        file=uncompressed_file,  # type: ignore[arg-type]
+        size=size,
         filename=filename,
         headers=Headers({"content-type": return_content_type(filename)}),
     )
 
 
-@router.post("/test-project/v1/process-file-1")
-@router.post("/test-project/v1.2.3/process-file-1")
-def pipeline_1(
+@router.post(
+    "/test-project/v1/process-file-1", response_class=PipelineJSONResponse, response_model=None
+)
+@router.post(
+    "/test-project/v1.2.3/process-file-1", response_class=PipelineJSONResponse, response_model=None
+)
+async def pipeline_1(
     request: Request,
     gz_uncompressed_content_type: Optional[str] = Form(default=None),
     files: Union[List[UploadFile], None] = File(default=None),
@@ -158,16 +785,34 @@ def pipeline_1(
     if files:
         for file_index in range(len(files)):
             if files[file_index].content_type == "application/gzip":
-                files[file_index] = ungz_file(files[file_index], gz_uncompressed_content_type)
+                files[file_index] = await run_in_threadpool(
+                    ungz_file, files[file_index], gz_uncompressed_content_type
+                )
 
     content_type = request.headers.get("Accept")
 
+    cache_key: Optional[str] = None
+    if get_response_cache() is not None:
+        cache_key = await get_response_cache_key(
+            [
+                "/test-project/v1.2.3/process-file-1",
+                content_type,
+                gz_uncompressed_content_type,
+                input2,
+            ],
+            files or [],
+        )
+        cached_response = await get_cached_response(cache_key)
+        if cached_response is not None:
+            return cached_response
+
     if isinstance(files, list) and len(files):
         if len(files) > 1:
             if content_type and content_type not in [
                 "*/*",
                 "multipart/mixed",
                 "application/json",
+                "application/x-ndjson",
                 "text/csv",
             ]:
                 raise HTTPException(
@@ -178,33 +823,54 @@ def pipeline_1(
                     status_code=status.HTTP_406_NOT_ACCEPTABLE,
                 )
 
-        def response_generator(is_multipart):
-            for file in files:
-                file_content_type = get_validated_mimetype(file)
+        async def call_pipeline_api(file):
+            file_content_type = get_validated_mimetype(file)
 
-                _file = file.file
+            _file = file.file
 
-                response = pipeline_api(
-                    _file,
-                    m_input2=input2,
-                    filename=file.filename,
-                    file_content_type=file_content_type,
-                )
+            return await run_pipeline_api(
+                _file,
+                m_input2=input2,
+                filename=file.filename,
+                file_content_type=file_content_type,
+            )
+
+        async def response_generator(is_multipart):
+            pipeline_api_calls = [call_pipeline_api(file) for file in files]
+            async for response in iterate_in_order(pipeline_api_calls):
+                if inspect.isasyncgen(response):
+                    stream = True
+
+                    if stream and is_multipart:
+                        # Each element of a streamed result is sent as its own part
+                        async for element in response:
+                            yield element if type(element) in [str, bytes] else json_dumps(element)
+                        continue
+                    elif stream and len(pipeline_api_calls) == 1:
+                        if content_type == "application/x-ndjson":
+                            yield response
+                        else:
+                            yield stream_json_array(response)
+                        continue
+                    response = [element async for element in response]
 
                 if is_multipart:
                     if type(response) not in [str, bytes]:
-                        response = json.dumps(response)
+                        response = json_dumps(response)
                 yield response
 
         if content_type == "multipart/mixed":
             return MultipartMixedResponse(
                 response_generator(is_multipart=True),
             )
+        elif content_type == "application/x-ndjson":
+            return await stream_ndjson(
+                response_generator(is_multipart=False), is_single_file=len(files) == 1
+            )
         else:
-            return (
-                list(response_generator(is_multipart=False))[0]
-                if len(files) == 1
-                else response_generator(is_multipart=False)
+            responses = [response async for response in response_generator(is_multipart=False)]
+            return await cache_response(
+                cache_key, json_response(responses[0] if len(files) == 1 else responses)
             )
     else:
         raise HTTPException(
@@ -0,0 +1,58 @@
+import os
+
+import unstructured_api_tools.pipelines.cache as cache
+
+
+def test_hash_content_is_deterministic():
+    assert cache.hash_content("a", "b") == cache.hash_content("a", "b")
+
+
+def test_hash_content_separates_parts():
+    assert cache.hash_content("ab", "c") != cache.hash_content("a", "bc")
+
+
+def test_read_cache_returns_none_for_missing_key(tmpdir):
+    assert cache.read_cache(str(tmpdir), "missing") is None
+
+
+def test_write_and_read_cache(tmpdir):
+    cache_dir = os.path.join(str(tmpdir), "nested", "cache")
+    cache.write_cache(cache_dir, "key", "content")
+    assert cache.read_cache(cache_dir, "key") == "content"
+
+    cache.write_cache(cache_dir, "key", "new content")
+    assert cache.read_cache(cache_dir, "key") == "new content"
+    assert os.listdir(cache_dir) == ["key"]
+
+
+def test_read_cache_refreshes_mtime(tmpdir):
+    cache_dir = str(tmpdir)
+    cache.write_cache(cache_dir, "key", "content")
+    os.utime(cache.get_cache_path(cache_dir, "key"), (0, 0))
+
+    cache.read_cache(cache_dir, "key")
+    assert os.path.getmtime(cache.get_cache_path(cache_dir, "key")) > 0
+
+
+def test_evict_cache_removes_least_recently_used(tmpdir):
+    cache_dir = str(tmpdir)
+    for i, key in enumerate(["old", "middle", "new"]):
+        cache.write_cache(cache_dir, key, "content")
+        os.utime(cache.get_cache_path(cache_dir, key), (1000 + i, 1000 + i))
+
+    assert cache.evict_cache(cache_dir, max_entries=2, max_age=None) == 1
+    assert sorted(os.listdir(cache_dir)) == ["middle", "new"]
+
+
+def test_evict_cache_removes_expired_entries(tmpdir):
+    cache_dir = str(tmpdir)
+    cache.write_cache(cache_dir, "expired", "content")
+    cache.write_cache(cache_dir, "fresh", "content")
+    os.utime(cache.get_cache_path(cache_dir, "expired"), (0, 0))
+
+    assert cache.evict_cache(cache_dir, max_entries=None, max_age=60) == 1
+    assert os.listdir(cache_dir) == ["fresh"]
+
+
+def test_evict_cache_with_missing_dir(tmpdir):
+    assert cache.evict_cache(os.path.join(str(tmpdir), "missing")) == 0
@@ -1,7 +1,12 @@
+import imp
+import inspect
 import json
 import os
 import pytest
 import re
+import shutil
+import subprocess
+import sys
 import yaml
 
 from nbformat import NotebookNode
@@ -76,6 +81,41 @@ def test_generate_pipeline_api(sample_notebook, tmpdir):
     convert.generate_pipeline_api(filename, pipeline_family="sec_filings", semver="2.0.1")
 
 
+def test_generate_pipeline_api_in_process_lint_mode(sample_notebook, tmpdir):
+    filename = os.path.join(tmpdir, "pipeline-test-notebook.ipynb")
+    with open(filename, "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+
+    kwargs = {"pipeline_family": "sec_filings", "semver": "2.0.1"}
+    assert convert.generate_pipeline_api(
+        filename, lint_mode="in-process", **kwargs
+    ) == convert.generate_pipeline_api(filename, **kwargs)
+
+
+def test_generate_pipeline_api_does_not_import_pandas(sample_notebook, tmpdir):
+    sample_notebook["cells"][-1]["source"] = (
+        "# pipeline-api\n"
+        "def pipeline_api(text: str, response_type: str = 'text/csv'):\n"
+        "    return text"
+    )
+    filename = os.path.join(tmpdir, "pipeline-test-notebook.ipynb")
+    with open(filename, "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+
+    content = convert.generate_pipeline_api(filename, pipeline_family="sec_filings", semver="2.0.1")
+    assert "def join_csv_responses" in content
+    assert not re.search(r"^(import|from) pandas", content, flags=re.MULTILINE)
+
+    module_filename = os.path.join(tmpdir, "pipeline_module.py")
+    with open(module_filename, "w") as f:
+        f.write(content)
+    script = (
+        f"import runpy, sys; runpy.run_path({module_filename!r}); print('pandas' in sys.modules)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script])
+    assert output.decode().strip() == "False"
+
+
 def test_read_notebook(sample_notebook, tmpdir):
     filename = os.path.join(tmpdir.dirname, "pipeline-test-notebook.ipynb")
     with open(filename, "w") as f:
@@ -321,6 +361,92 @@ def test_infer_m_params():
     )
 
 
+@pytest.mark.parametrize(
+    "api_definition",
+    [
+        "def pipeline_api(text): pass",
+        "def pipeline_api(text, m_var=[], response_type='text/csv'): pass",
+        "def pipeline_api(file, file_content_type=None, filename=None, m_var=[]): pass",
+        "async def pipeline_api(text, request, *, response_schema='isd'): pass",
+        "def pipeline_api(text, /, m_var=[], *args, m_kw=[], **kwargs): pass",
+        "def pipeline_api(file): pass\ndef pipeline_api(text, m_var=[]): pass",
+        "import os\ndef pipeline_api(text, m_var=[]): pass",
+        "try:\n    import pandas\nexcept ImportError:\n    pass\ndef pipeline_api(text): pass",
+    ],
+)
+def test_parse_pipeline_api_signature_matches_exec(api_definition):
+    module = imp.new_module("module")
+    exec(api_definition, module.__dict__)
+
+    signature = convert._parse_pipeline_api_signature(api_definition)
+    assert signature == inspect.signature(module.pipeline_api)
+
+
+@pytest.mark.parametrize(
+    "api_definition",
+    [
+        "RESPONSE_TYPE = 'text/csv'\ndef pipeline_api(text, response_type=RESPONSE_TYPE): pass",
+        "@decorator\ndef pipeline_api(text): pass",
+        "pipeline_api = lambda text: text",
+        "def pipeline_api(text:",
+        "def pipeline_api(text): pass\npipeline_api = wrap(pipeline_api)",
+        "def pipeline_api(text): pass\npipeline_api: Callable = wrap(pipeline_api)",
+        "def pipeline_api(text): pass\npipeline_api += 1",
+        "def pipeline_api(text): pass\nfrom module import wrapped as pipeline_api",
+        "def pipeline_api(text): pass\nfrom module import *",
+        "def pipeline_api(text): pass\nclass pipeline_api: pass",
+        "def pipeline_api(text): pass\nfor pipeline_api in wrappers: pass",
+        "def pipeline_api(text): pass\nwith wrap() as pipeline_api: pass",
+        "def pipeline_api(text): pass\nif DEBUG:\n    def pipeline_api(text, m_var=[]): pass",
+        "def pipeline_api(text): pass\ntry:\n    def pipeline_api(file): pass\nexcept: pass",
+    ],
+)
+def test_parse_pipeline_api_signature_returns_none(api_definition):
+    assert convert._parse_pipeline_api_signature(api_definition) is None
+
+
+def test_infer_params_uses_rebound_pipeline_api():
+    script = """def _wrap(f):
+    def wrapped(text, m_extra=[]):
+        return f(text)
+    return wrapped
+
+def pipeline_api(text):
+    return text
+
+pipeline_api = _wrap(pipeline_api)
+"""
+    assert convert._infer_params_from_pipeline_api(script)["multi_string_param_names"] == ["extra"]
+
+
+def test_infer_params_does_not_execute_script():
+    script = """raise RuntimeError("Loading a model at import time.")
+
+def pipeline_api(text, m_var=[], response_type="text/csv"):
+    pass
+"""
+    assert convert._infer_params_from_pipeline_api(script)["multi_string_param_names"] == ["var"]
+
+
+def test_infer_params_falls_back_to_exec_for_non_literal_defaults():
+    script = """RESPONSE_TYPE = "text/csv"
+
+def pipeline_api(text, response_type=RESPONSE_TYPE):
+    pass
+"""
+    assert convert._infer_params_from_pipeline_api(script)["optional_param_value_map"] == {
+        "response_type": "text/csv"
+    }
+
+
+def test_get_template_environment_is_reused():
+    environment = convert._get_template_environment()
+    assert convert._get_template_environment() is environment
+    assert environment.bytecode_cache is not None
+    template = environment.get_template("pipeline_api.txt")
+    assert environment.get_template("pipeline_api.txt") is template
+
+
 def test_notebook_file_to_script(sample_notebook, tmpdir):
     input_filename = os.path.join(tmpdir.dirname, "pipeline-this-is-a-test.ipynb")
     with open(input_filename, "w") as f:
@@ -342,6 +468,49 @@ def test_notebook_file_to_script(sample_notebook, tmpdir):
     assert "pipeline_api" in script
 
 
+def test_notebook_file_to_script_uses_cache(sample_notebook, tmpdir, mocker):
+    input_filename = os.path.join(tmpdir, "pipeline-this-is-a-test.ipynb")
+    with open(input_filename, "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+    cache_dir = os.path.join(tmpdir, "cache")
+    output_filename = os.path.join(tmpdir, "this_is_a_test.py")
+    kwargs = {"pipeline_family": "test-family", "semver": "0.2.1", "cache_dir": cache_dir}
+
+    generate_pipeline_api = mocker.spy(convert, "generate_pipeline_api")
+    convert.notebook_file_to_script(input_filename, str(tmpdir), **kwargs)
+    assert generate_pipeline_api.call_count == 1
+    with open(output_filename, "r") as f:
+        script = f.read()
+
+    os.remove(output_filename)
+    convert.notebook_file_to_script(input_filename, str(tmpdir), **kwargs)
+    assert generate_pipeline_api.call_count == 1
+    with open(output_filename, "r") as f:
+        assert f.read() == script
+
+    convert.notebook_file_to_script(input_filename, str(tmpdir), **kwargs, flake8_opts=[])
+    assert generate_pipeline_api.call_count == 2
+
+    sample_notebook["cells"][0]["source"] += "\nimport os"
+    with open(input_filename, "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+    convert.notebook_file_to_script(input_filename, str(tmpdir), **kwargs)
+    assert generate_pipeline_api.call_count == 3
+
+
+def test_conversion_cache_key_ignores_non_api_cells(sample_notebook, tmpdir):
+    input_filename = os.path.join(tmpdir, "pipeline-this-is-a-test.ipynb")
+    with open(input_filename, "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+    key = convert._get_conversion_cache_key(input_filename, "test-family", "0.2.1")
+
+    sample_notebook["cells"][1]["source"] = "print('not part of the api')"
+    with open(input_filename, "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+    assert convert._get_conversion_cache_key(input_filename, "test-family", "0.2.1") == key
+    assert convert._get_conversion_cache_key(input_filename, "test-family", "0.2.2") != key
+
+
 def test_convert_notebook_files_to_api(sample_notebook, tmpdir):
     fake_config = {
         "name": "fake",
@@ -387,6 +556,124 @@ def test_convert_notebook_files_to_api(sample_notebook, tmpdir):
     assert "This is the best API ever!" in script
 
 
+def test_convert_notebook_files_to_api_runs_mypy_once(sample_notebook, tmpdir, mocker):
+    notebook_filenames = []
+    for i in range(3):
+        filename = f"pipeline-test-notebook-{i}.ipynb"
+        with open(os.path.join(tmpdir, filename), "w") as f:
+            json.dump(sample_notebook, f, indent=4)
+        notebook_filenames.append(filename)
+
+    check_mypy = mocker.spy(convert.lint, "check_mypy")
+    check_mypy_modules = mocker.spy(convert.lint, "check_mypy_modules")
+    convert.convert_notebook_files_to_api(
+        notebook_filenames,
+        input_directory=str(tmpdir),
+        output_directory=str(tmpdir),
+        pipeline_family="test-family",
+        semver="0.2.1",
+    )
+
+    assert check_mypy.call_count == 0
+    assert check_mypy_modules.call_count == 1
+    modules = check_mypy_modules.call_args[0][0]
+    assert sorted(modules) == ["app", "test_notebook_0", "test_notebook_1", "test_notebook_2"]
+    with open(os.path.join(tmpdir, "test_notebook_1.py")) as f:
+        assert modules["test_notebook_1"] == f.read()
+
+
+def test_convert_notebook_files_to_api_uses_lint_cache(sample_notebook, tmpdir, mocker):
+    with open(os.path.join(tmpdir, "pipeline-test-notebook.ipynb"), "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+    cache_dir = os.path.join(tmpdir, "cache")
+    kwargs = {
+        "input_directory": str(tmpdir),
+        "output_directory": str(tmpdir),
+        "pipeline_family": "test-family",
+        "semver": "0.2.1",
+        "cache_dir": cache_dir,
+    }
+
+    convert.convert_notebook_files_to_api(["pipeline-test-notebook.ipynb"], **kwargs)
+    with open(os.path.join(tmpdir, "test_notebook.py")) as f:
+        script = f.read()
+
+    # Without the cached scripts the notebook is regenerated, but since it generates to
+    # the same text, none of the formatters or linters run again
+    shutil.rmtree(os.path.join(cache_dir, convert.CONVERSION_CACHE_SUBDIR))
+    generate_pipeline_api = mocker.spy(convert, "generate_pipeline_api")
+    format_str = mocker.spy(convert.lint, "format_str")
+    execute_lint_cmd = mocker.spy(convert.lint, "_execute_lint_cmd")
+    convert.convert_notebook_files_to_api(["pipeline-test-notebook.ipynb"], **kwargs)
+
+    assert generate_pipeline_api.call_count == 1
+    assert format_str.call_count == 0
+    assert execute_lint_cmd.call_count == 0
+    with open(os.path.join(tmpdir, "test_notebook.py")) as f:
+        assert f.read() == script
+
+
+def test_convert_notebook_files_to_api_reports_module_with_type_error(
+    sample_notebook, tmpdir, monkeypatch
+):
+    monkeypatch.chdir(tmpdir)
+    input_directory = tmpdir.mkdir("notebooks")
+    for name in ["good", "bad"]:
+        with open(os.path.join(input_directory, f"pipeline-{name}.ipynb"), "w") as f:
+            json.dump(sample_notebook, f, indent=4)
+    sample_notebook["cells"][3][
+        "source"
+    ] = "# pipeline-api\ndef pipeline_api(text: str) -> str:\n    return len(text)"
+    with open(os.path.join(input_directory, "pipeline-bad.ipynb"), "w") as f:
+        json.dump(sample_notebook, f, indent=4)
+
+    with pytest.raises(convert.lint.LintError) as exc_info:
+        convert.convert_notebook_files_to_api(
+            ["pipeline-bad.ipynb", "pipeline-good.ipynb"],
+            input_directory=str(input_directory),
+            output_directory=str(tmpdir),
+            pipeline_family="test-family",
+            semver="0.2.1",
+        )
+
+    errors = str(exc_info.value.__cause__)
+    assert "\nbad:\n" in errors
+    assert "good:" not in errors
+
+
+def test_convert_notebook_files_to_api_in_parallel_matches_serial(sample_notebook, tmpdir):
+    input_directory = tmpdir.mkdir("notebooks")
+    notebook_filenames = []
+    for i in range(3):
+        filename = f"pipeline-test-notebook-{i}.ipynb"
+        with open(os.path.join(input_directory, filename), "w") as f:
+            json.dump(sample_notebook, f, indent=4)
+        notebook_filenames.append(filename)
+
+    output_directories = {}
+    for jobs in [1, 3]:
+        output_directory = tmpdir.mkdir(f"api-{jobs}")
+        convert.convert_notebook_files_to_api(
+            notebook_filenames,
+            input_directory=str(input_directory),
+            output_directory=str(output_directory),
+            pipeline_family="test-family",
+            semver="0.2.1",
+            jobs=jobs,
+        )
+        output_directories[jobs] = output_directory
+
+    serial_files = sorted(os.listdir(output_directories[1]))
+    assert serial_files == sorted(os.listdir(output_directories[3]))
+    assert "app.py" in serial_files
+    for filename in serial_files:
+        with open(os.path.join(output_directories[1], filename)) as f:
+            serial_script = f.read()
+        with open(os.path.join(output_directories[3], filename)) as f:
+            parallel_script = f.read()
+        assert serial_script == parallel_script
+
+
 @pytest.mark.parametrize(
     "bad_filename",
     [("crocodile.ipynb",), ("pipeline-app.ipynb",)],
@@ -439,25 +726,59 @@ def another_function():
     )
 
 
-def test_get_multiline_import():
-    lines = ["from unstructured import (", "func1,", "func2", ")", "", "def hello(): pass"]
-    multiline_import, length = convert._get_multiline_import(lines)
-    assert length == 4
+def test_organize_imports_leaves_nested_imports_in_place():
+    script = """def hello_world():
+    from os import path
+    return path
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+import os; x = 1
+from __future__ import annotations
+"""
     assert (
-        multiline_import
-        == """from unstructured import (
-func1,
-func2
-)"""
+        convert._organize_imports(script)
+        == """from __future__ import annotations
+
+def hello_world():
+    from os import path
+    return path
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+import os; x = 1
+"""
     )
 
 
-def test_get_multiline_import_raises_with_no_import():
-    with pytest.raises(ValueError):
-        convert._get_multiline_import(["def hello(): pass"])
+def test_organize_imports_drops_duplicate_imports():
+    script = """import os
+from typing import List
+
+def hello_world():
+    pass
+
+import os, sys
+from typing import List, Dict
+from typing import List as L
+"""
+    assert (
+        convert._organize_imports(script)
+        == """import os
+from typing import List
+import sys
+from typing import Dict
+from typing import List as L
 
 
-def test_get_multiline_raises_with_no_parens():
-    lines = ["from unstructured import func1", "func1,", "func2", ")", "", "def hello(): pass"]
-    with pytest.raises(ValueError):
-        convert._get_multiline_import(lines)
+def hello_world():
+    pass
+
+"""
+    )
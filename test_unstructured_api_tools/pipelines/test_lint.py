@@ -23,13 +23,26 @@ def test_run_lint_cmd_cleans_up_on_exception(monkeypatch):
     mock_unlink.assert_called_once()
 
 
-def test_flake8():
+def test_run_lint_cmd_in_process_cleans_up_on_exception(monkeypatch):
+    def mock_linter(args):
+        raise ValueError("Squawk!")
+
+    monkeypatch.setitem(lint.IN_PROCESS_LINTERS, "fake", mock_linter)
+    with patch.object(os, "unlink", return_value=None) as mock_unlink:
+        with pytest.raises(ValueError):
+            lint._run_lint_cmd(["fake"], "fake.py", re.compile("[A-Z]"), mode="in-process")
+
+    mock_unlink.assert_called_once()
+
+
+@pytest.mark.parametrize("mode", lint.LINT_MODES)
+def test_flake8(mode):
     file_text = """# A test file
 
 def hello_world():
     pass
 """
-    assert lint.check_flake8(file_text) is True
+    assert lint.check_flake8(file_text, mode=mode) is True
 
 
 def test_flake8_passes_with_unsued_import():
@@ -43,13 +56,48 @@ def hello_world():
     assert lint.check_flake8(file_text) is True
 
 
-def test_flake8_raises_with_bad_lint():
+@pytest.mark.parametrize("mode", lint.LINT_MODES)
+def test_flake8_raises_with_bad_lint(mode):
     file_text = """# A test file
 
 def hello_world()   :
     pass"""
+    with pytest.raises(lint.LintError) as exc_info:
+        lint.check_flake8(file_text, mode=mode)
+
+    assert "tmp-flake8-check-pipeline-api.py" in str(exc_info.value)
+    assert str(exc_info.value.__cause__) == (
+        "\n\nE203 whitespace before ':'\nW292 no newline at end of file\n"
+    )
+
+
+def test_flake8_in_process_respects_opts():
+    file_text = """# A test file
+import os
+
+
+def hello_world():
+    pass
+"""
     with pytest.raises(lint.LintError):
-        lint.check_flake8(file_text)
+        lint.check_flake8(file_text, opts=["--max-line-length", "100"], mode="in-process")
+    assert lint.check_flake8(file_text, opts=["--ignore=F401"], mode="in-process") is True
+
+
+def test_flake8_opts_to_kwargs():
+    assert lint._flake8_opts_to_kwargs(
+        ["--max-line-length", "100", "--ignore", "E402, F401", "--show-source", "--format=pylint"]
+    ) == {
+        "max_line_length": 100,
+        "ignore": ["E402", "F401"],
+        "show_source": True,
+        "format": "pylint",
+    }
+
+
+def test_check_flake8_raises_with_invalid_mode():
+    with pytest.raises(ValueError):
+        lint.check_flake8("", mode="carrier-pigeon")
 
 
 def test_format_black():
@@ -80,23 +128,34 @@ def test_validate_flake8_ignore_bad_input():
         lint.validate_flake8_ignore("NOT A REAL CODE")
 
 
-def test_mypy():
+@pytest.fixture
+def dmypy_workdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    yield tmpdir
+    lint.stop_mypy_daemon()
+
+
+@pytest.mark.parametrize("mode", lint.LINT_MODES)
+def test_mypy(mode, dmypy_workdir):
     file_text = """# A test file
 
 def hello_world(text: str) -> str:
     return text
 """
-    assert lint.check_mypy(file_text) is True
+    assert lint.check_mypy(file_text, mode=mode) is True
 
 
-def test_mypy_raises_with_bad_type():
+@pytest.mark.parametrize("mode", lint.LINT_MODES)
+def test_mypy_raises_with_bad_type(mode, dmypy_workdir):
     file_text = """# A test file
 
 def hello_world(text: str) -> str:
     return int(text)
 """
-    with pytest.raises(lint.LintError):
-        lint.check_mypy(file_text)
+    with pytest.raises(lint.LintError) as exc_info:
+        lint.check_mypy(file_text, mode=mode)
+
+    assert "Incompatible return value type" in str(exc_info.value.__cause__)
 
 
 def test_check_black():
@@ -118,3 +177,113 @@ def hello_world()   :
 """
     with pytest.raises(lint.LintError):
         lint.check_black(file_text)
+
+
+@pytest.mark.parametrize("mode", lint.LINT_MODES)
+def test_check_mypy_modules(mode, dmypy_workdir):
+    modules = {
+        "hello": """def hello_world(text: str) -> str:
+    return text
+""",
+        "app": """from .hello import hello_world
+
+greeting: str = hello_world("hi")
+""",
+    }
+    assert lint.check_mypy_modules(modules, mode=mode) is True
+
+
+@pytest.mark.parametrize("mode", lint.LINT_MODES)
+def test_check_mypy_modules_groups_errors_by_module(mode, dmypy_workdir):
+    modules = {
+        "hello": """def hello_world(text: str) -> str:
+    return int(text)
+""",
+        "goodbye": """def goodbye_world(text: str) -> str:
+    return text
+""",
+        "app": """from .goodbye import goodbye_world
+
+greeting: int = goodbye_world("bye")
+""",
+    }
+    with pytest.raises(lint.LintError) as exc_info:
+        lint.check_mypy_modules(modules, mode=mode)
+
+    assert "mypy tmp_mypy_check_pipeline_api/api" in str(exc_info.value)
+    assert os.path.exists(os.path.join("tmp_mypy_check_pipeline_api", "api", "hello.py"))
+
+    errors = str(exc_info.value.__cause__)
+    assert "hello:\n2: error: Incompatible return value type" in errors
+    assert "app:\n3: error: Incompatible types in assignment" in errors
+    assert "goodbye:" not in errors
+
+
+def test_check_mypy_modules_with_dmypy(dmypy_workdir):
+    modules = {
+        "hello": """def hello_world(text: str) -> str:
+    return text
+""",
+        "app": """from .hello import hello_world
+
+greeting: str = hello_world("hi")
+""",
+    }
+    assert lint.check_mypy_modules(modules, mode="dmypy") is True
+    assert os.path.exists(lint.DMYPY_STATUS_FILE)
+
+    modules[
+        "app"
+    ] = """from .hello import hello_world
+
+greeting: int = hello_world("hi")
+"""
+    with pytest.raises(lint.LintError) as exc_info:
+        lint.check_mypy_modules(modules, mode="dmypy")
+    assert "app:\n3: error: Incompatible types in assignment" in str(exc_info.value.__cause__)
+
+    assert lint.stop_mypy_daemon() is True
+    assert not os.path.exists(lint.DMYPY_STATUS_FILE)
+
+
+def test_sync_package_only_rewrites_changed_modules(tmpdir):
+    package_dir = lint._sync_package(str(tmpdir), {"hello": "x = 1\n", "goodbye": "y = 2\n"})
+    hello_filename = os.path.join(package_dir, "hello.py")
+    os.utime(hello_filename, (0, 0))
+
+    lint._sync_package(str(tmpdir), {"hello": "x = 1\n", "app": "z = 3\n"})
+    assert sorted(os.listdir(package_dir)) == ["__init__.py", "app.py", "hello.py"]
+    assert os.path.getmtime(hello_filename) == 0
+
+
+def test_stop_mypy_daemon_without_daemon(dmypy_workdir):
+    assert lint.stop_mypy_daemon() is False
+
+
+def test_format_black_uses_cache(tmpdir, mocker):
+    cache_dir = str(tmpdir)
+    format_str = mocker.spy(lint, "format_str")
+
+    formatted_text = lint.format_black("x  =  1\n", cache_dir=cache_dir)
+    assert lint.format_black("x  =  1\n", cache_dir=cache_dir) == formatted_text == "x = 1\n"
+    assert format_str.call_count == 1
+
+    lint.format_black("y  =  1\n", cache_dir=cache_dir)
+    assert format_str.call_count == 2
+
+
+def test_check_flake8_caches_only_passing_results(tmpdir, mocker):
+    cache_dir = str(tmpdir)
+    execute_lint_cmd = mocker.spy(lint, "_execute_lint_cmd")
+
+    for _ in range(2):
+        assert lint.check_flake8("x = 1\n", cache_dir=cache_dir, mode="in-process") is True
+    assert execute_lint_cmd.call_count == 1
+
+    lint.check_flake8("x = 1\n", opts=["--max-line-length", "80"], cache_dir=cache_dir)
+    assert execute_lint_cmd.call_count == 2
+
+    for _ in range(2):
+        with pytest.raises(lint.LintError):
+            lint.check_flake8("x = 1  \n", cache_dir=cache_dir, mode="in-process")
+    assert execute_lint_cmd.call_count == 4
@@ -0,0 +1,130 @@
+import os
+
+import nbformat
+import pytest
+
+import unstructured_api_tools.pipelines.lint as lint
+import unstructured_api_tools.pipelines.watch as watch
+
+
+def write_notebook(filename, source="def pipeline_api(text):\n    return text"):
+    notebook = nbformat.v4.new_notebook()
+    notebook["cells"] = [nbformat.v4.new_code_cell(f"# pipeline-api\n{source}")]
+    with open(filename, "w") as f:
+        nbformat.write(notebook, f)
+
+
+class MockSleep:
+    """Runs one callback per call to sleep and stops the watch once they have all run."""
+
+    def __init__(self, *callbacks):
+        self.callbacks = list(callbacks)
+
+    def __call__(self, interval):
+        if not self.callbacks:
+            raise KeyboardInterrupt
+        self.callbacks.pop(0)()
+
+
+@pytest.fixture
+def watch_dir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    for name in ["pipeline-first.ipynb", "pipeline-second.ipynb"]:
+        write_notebook(os.path.join(tmpdir, name))
+    return str(tmpdir)
+
+
+def test_get_changed_notebooks():
+    previous_stats = {"a.ipynb": (1, 10), "b.ipynb": (1, 10), "c.ipynb": (1, 10)}
+    current_stats = {"a.ipynb": (1, 10), "b.ipynb": (2, 10), "d.ipynb": (1, 10)}
+    assert watch.get_changed_notebooks(previous_stats, current_stats) == ["b.ipynb", "d.ipynb"]
+
+
+def test_get_notebook_stats(watch_dir):
+    with open(os.path.join(watch_dir, "README.md"), "w") as f:
+        f.write("not a notebook")
+    assert sorted(watch.get_notebook_stats(watch_dir)) == [
+        "pipeline-first.ipynb",
+        "pipeline-second.ipynb",
+    ]
+
+
+def test_watch_only_converts_changes(watch_dir, mocker, monkeypatch):
+    convert = mocker.patch.object(watch, "convert_notebook_files_to_api")
+
+    def modify_notebook():
+        write_notebook(
+            os.path.join(watch_dir, "pipeline-first.ipynb"), "def pipeline_api(file): pass"
+        )
+
+    def add_notebook():
+        write_notebook(os.path.join(watch_dir, "pipeline-third.ipynb"))
+
+    monkeypatch.setattr(watch.time, "sleep", MockSleep(modify_notebook, lambda: None, add_notebook))
+    watch.watch_notebook_files_to_api(watch_dir, watch_dir, "test-family", "0.2.1")
+
+    calls = [call.kwargs for call in convert.call_args_list]
+    assert [(c["changed_notebook_filenames"], c["build_app"]) for c in calls] == [
+        (["pipeline-first.ipynb", "pipeline-second.ipynb"], True),
+        (["pipeline-first.ipynb"], False),
+        (["pipeline-third.ipynb"], True),
+    ]
+    assert calls[0]["lint_mode"] == "in-process"
+
+
+def test_watch_retries_failed_notebooks_with_next_change(watch_dir, mocker, monkeypatch):
+    convert = mocker.patch.object(
+        watch, "convert_notebook_files_to_api", side_effect=[None, lint.LintError("Squawk!"), None]
+    )
+
+    def modify_notebook(name):
+        return lambda: write_notebook(os.path.join(watch_dir, name), "def pipeline_api(file): pass")
+
+    monkeypatch.setattr(
+        watch.time,
+        "sleep",
+        MockSleep(
+            modify_notebook("pipeline-first.ipynb"), modify_notebook("pipeline-second.ipynb")
+        ),
+    )
+    watch.watch_notebook_files_to_api(watch_dir, watch_dir, "test-family", "0.2.1")
+
+    assert convert.call_count == 3
+    assert convert.call_args.kwargs["changed_notebook_filenames"] == [
+        "pipeline-first.ipynb",
+        "pipeline-second.ipynb",
+    ]
+
+
+def test_watch_regenerates_everything_when_config_changes(watch_dir, mocker, monkeypatch):
+    convert = mocker.patch.object(watch, "convert_notebook_files_to_api")
+    config_filename = os.path.join(watch_dir, "preprocessing-pipeline-family.yaml")
+
+    def write_config():
+        with open(config_filename, "w") as f:
+            f.write("name: test-family\nversion: 0.2.1\n")
+
+    monkeypatch.setattr(watch.time, "sleep", MockSleep(write_config))
+    watch.watch_notebook_files_to_api(watch_dir, watch_dir, config_filename=config_filename)
+
+    assert convert.call_count == 2
+    assert convert.call_args.kwargs["changed_notebook_filenames"] == [
+        "pipeline-first.ipynb",
+        "pipeline-second.ipynb",
+    ]
+    assert convert.call_args.kwargs["build_app"] is True
+
+
+def test_watch_regenerates_modified_notebook(watch_dir, monkeypatch):
+    def modify_notebook():
+        write_notebook(
+            os.path.join(watch_dir, "pipeline-first.ipynb"),
+            "def pipeline_api(text, m_modified=[]):\n    return text",
+        )
+
+    monkeypatch.setattr(watch.time, "sleep", MockSleep(modify_notebook))
+    watch.watch_notebook_files_to_api(watch_dir, watch_dir, "test-family", "0.2.1")
+
+    with open(os.path.join(watch_dir, "first.py")) as f:
+        assert "m_modified" in f.read()
+    assert os.path.exists(os.path.join(watch_dir, "app.py"))
@@ -124,3 +124,66 @@ def test_convert_pipeline_notebooks_passing_flake8_ignore(sample_notebook, tmpdi
     for i in range(5):
         assert f"this_is_a_test_{i}.py" in files
     assert "app.py" in files
+
+
+def test_convert_pipeline_notebooks_with_jobs(sample_notebook, tmpdir):
+    for i in range(3):
+        filename = os.path.join(tmpdir, f"pipeline-this-is-a-test-{i}.ipynb")
+        with open(filename, "w") as f:
+            json.dump(sample_notebook, f, indent=4)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli,
+        [
+            "convert-pipeline-notebooks",
+            "--input-directory",
+            str(tmpdir),
+            "--output-directory",
+            str(tmpdir),
+            "--pipeline-family",
+            "fake-family-name",
+            "--semver",
+            "2.1.1",
+            "--jobs",
+            "2",
+        ],
+    )
+    assert result.exit_code == 0
+
+    files = os.listdir(tmpdir)
+    for i in range(3):
+        assert f"this_is_a_test_{i}.py" in files
+    assert "app.py" in files
+
+
+def test_stop_mypy_daemon_without_daemon(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    runner = CliRunner()
+    result = runner.invoke(cli.cli, ["stop-mypy-daemon"])
+    assert result.exit_code == 0
+    assert "No mypy daemon is running." in result.output
+
+
+def test_convert_pipeline_notebooks_with_watch(tmpdir, mocker):
+    watch_notebook_files_to_api = mocker.patch.object(cli, "watch_notebook_files_to_api")
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli,
+        [
+            "convert-pipeline-notebooks",
+            "--input-directory",
+            str(tmpdir),
+            "--output-directory",
+            str(tmpdir),
+            "--flake8-ignore",
+            "E501",
+            "--watch",
+        ],
+    )
+    assert result.exit_code == 0
+
+    watch_notebook_files_to_api.assert_called_once()
+    kwargs = watch_notebook_files_to_api.call_args.kwargs
+    assert kwargs["lint_mode"] == "in-process"
+    assert kwargs["flake8_opts"] == ["--max-line-length", "100", "--ignore", "E501"]
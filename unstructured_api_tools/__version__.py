@@ -1 +1 @@
-__version__ = "0.10.11"  # pragma: no cover
+__version__ = "0.10.12-dev23"  # pragma: no cover
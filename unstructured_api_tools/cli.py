@@ -1,13 +1,17 @@
+import logging
 import os
-from typing import Optional
+from typing import List, Optional
 
 import click
 
 from unstructured_api_tools.pipelines.convert import convert_notebook_files_to_api
 from unstructured_api_tools.pipelines.lint import (
     FLAKE8_DEFAULT_OPTS,
+    LINT_MODES,
+    stop_mypy_daemon as stop_lint_mypy_daemon,
     validate_flake8_ignore,
 )
+from unstructured_api_tools.pipelines.watch import watch_notebook_files_to_api
 
 
 @click.group()
@@ -22,6 +26,28 @@ def cli():
 @click.option("--semver")
 @click.option("--config-filename")
 @click.option("--flake8-ignore")
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of notebooks to convert concurrently.",
+)
+@click.option(
+    "--cache-dir",
+    help="Directory for caching generated scripts. Unchanged notebooks are not regenerated.",
+)
+@click.option(
+    "--lint-mode",
+    type=click.Choice(LINT_MODES),
+    help="How flake8 and mypy are run on the generated files. Defaults to in-process with "
+    "--watch and to subprocess otherwise.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Keep running and regenerate notebooks when they or the pipeline config change.",
+)
 def convert_pipeline_notebooks(
     input_directory: str,
     output_directory: str,
@@ -29,18 +55,29 @@ def convert_pipeline_notebooks(
     semver: Optional[str] = None,
     config_filename: Optional[str] = None,
     flake8_ignore: Optional[str] = None,
+    jobs: int = 1,
+    cache_dir: Optional[str] = None,
+    lint_mode: Optional[str] = None,
+    watch: bool = False,
 ):
     """Convert a pipeline notebook to a Python script. The conversion script will retain
     any cell that includes # pipeline-api at the top."""
-    notebook_filenames = sorted([f for f in os.listdir(input_directory) if f.endswith(".ipynb")])
+    if watch:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        watch_notebook_files_to_api(
+            input_directory,
+            output_directory,
+            pipeline_family=pipeline_family,
+            semver=semver,
+            config_filename=config_filename,
+            flake8_opts=_get_flake8_opts(flake8_ignore),
+            jobs=jobs,
+            cache_dir=cache_dir,
+            lint_mode=lint_mode or "in-process",
+        )
+        return
 
-    if flake8_ignore:
-        validate_flake8_ignore(flake8_ignore)
-        # NOTE(robinson) - Not making line length configurable because setting it to
-        # 100 allows flake8 to be consistent with black
-        flake8_opts = ["--max-line-length", "100", "--ignore", flake8_ignore]
-    else:
-        flake8_opts = FLAKE8_DEFAULT_OPTS
+    notebook_filenames = sorted([f for f in os.listdir(input_directory) if f.endswith(".ipynb")])
 
     convert_notebook_files_to_api(
         notebook_filenames,
@@ -49,9 +86,31 @@ def convert_pipeline_notebooks(
         pipeline_family=pipeline_family,
         semver=semver,
         config_filename=config_filename,
-        flake8_opts=flake8_opts,
+        flake8_opts=_get_flake8_opts(flake8_ignore),
+        jobs=jobs,
+        cache_dir=cache_dir,
+        lint_mode=lint_mode or "subprocess",
     )
 
 
+def _get_flake8_opts(flake8_ignore: Optional[str] = None) -> List[str]:
+    if flake8_ignore:
+        validate_flake8_ignore(flake8_ignore)
+        # NOTE(robinson) - Not making line length configurable because setting it to
+        # 100 allows flake8 to be consistent with black
+        return ["--max-line-length", "100", "--ignore", flake8_ignore]
+    return FLAKE8_DEFAULT_OPTS
+
+
+@cli.command()
+def stop_mypy_daemon():
+    """Stop the mypy daemon that convert-pipeline-notebooks starts with --lint-mode dmypy.
+    Run this from the directory the conversion was run from."""
+    if stop_lint_mypy_daemon():
+        click.echo("Stopped the mypy daemon.")
+    else:
+        click.echo("No mypy daemon is running.")
+
+
 if __name__ == "__main__":
     cli()  # pragma: nocover
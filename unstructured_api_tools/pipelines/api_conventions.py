@@ -5,10 +5,17 @@ import yaml
 import re
 
 
-def get_config(filename: Optional[str] = None):
+def get_config_filename(filename: Optional[str] = None) -> str:
+    """Returns the location of the pipeline family config. Uses the filename if one is passed,
+    then the PIPELINE_FAMILY_CONFIG environment variable and then the default location."""
     if filename is None:
         default = os.path.join(os.getcwd(), "preprocessing-pipeline-family.yaml")
         filename = os.environ.get("PIPELINE_FAMILY_CONFIG", default)
+    return filename
+
+
+def get_config(filename: Optional[str] = None):
+    filename = get_config_filename(filename)
 
     if not os.path.exists(filename):
         raise FileNotFoundError(
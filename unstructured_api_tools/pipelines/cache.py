@@ -0,0 +1,97 @@
+"""Tools for caching the outputs of pipeline notebook conversion on disk."""
+import hashlib
+import os
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+# Entries that have not been read or written for this many seconds are evicted
+CACHE_MAX_AGE: int = 30 * 24 * 60 * 60
+CACHE_MAX_ENTRIES: int = 1000
+TMP_PREFIX = ".tmp-"
+
+
+def hash_content(*parts: str) -> str:
+    """Returns a SHA-256 hex digest for the parts. Each part is length-prefixed so that
+    ("ab", "c") and ("a", "bc") hash to different values."""
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8")
+        digest.update(f"{len(encoded)}:".encode("utf-8"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def get_cache_path(cache_dir: str, key: str) -> str:
+    """Returns the location of the cache entry for the key."""
+    return os.path.join(cache_dir, key)
+
+
+def read_cache(cache_dir: str, key: str) -> Optional[str]:
+    """Returns the cached content for the key, or None if there is no entry. Reading an
+    entry refreshes its modification time, which evict_cache uses to find the least
+    recently used entries."""
+    cache_path = get_cache_path(cache_dir, key)
+    try:
+        with open(cache_path, "r") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        os.utime(cache_path)
+    except OSError:
+        # The entry was evicted by another process after it was read
+        pass
+    return content
+
+
+def write_cache(cache_dir: str, key: str, content: str):
+    """Stores the content under the key. The entry is written to a temporary file first
+    and then moved into place, so concurrent readers never see a partial entry."""
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, prefix=TMP_PREFIX)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_filename, get_cache_path(cache_dir, key))
+    except Exception as e:
+        os.unlink(tmp_filename)
+        raise e
+
+
+def evict_cache(
+    cache_dir: str,
+    max_entries: Optional[int] = CACHE_MAX_ENTRIES,
+    max_age: Optional[float] = CACHE_MAX_AGE,
+) -> int:
+    """Removes entries that have not been used for more than max_age seconds, then removes
+    the least recently used entries until at most max_entries remain. Returns the number of
+    entries that were removed."""
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries: List[Tuple[float, str]] = []
+    for filename in os.listdir(cache_dir):
+        if filename.startswith(TMP_PREFIX):
+            continue
+        cache_path = os.path.join(cache_dir, filename)
+        try:
+            entries.append((os.path.getmtime(cache_path), cache_path))
+        except FileNotFoundError:
+            continue
+    entries.sort(reverse=True)
+
+    now = time.time()
+    keep = len(entries) if max_entries is None else max_entries
+    expired = [
+        cache_path
+        for i, (mtime, cache_path) in enumerate(entries)
+        if i >= keep or (max_age is not None and now - mtime > max_age)
+    ]
+    for cache_path in expired:
+        try:
+            os.unlink(cache_path)
+        except FileNotFoundError:
+            pass
+    return len(expired)
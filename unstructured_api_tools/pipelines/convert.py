@@ -1,28 +1,30 @@
 """Tools for converting pipeline notebooks to Python scripts/REST APIs"""
+import ast
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
+import functools
 import imp
 import inspect
+import json
 import logging
 import os
 from pathlib import Path
 import re
-from typing import List, Optional, Any, Dict, Union, Tuple, Type
+from typing import List, Optional, Any, Dict, Set, Union, Tuple, Type
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from nbconvert import ScriptExporter
 import nbformat
 
+from unstructured_api_tools.__version__ import __version__
 from unstructured_api_tools.pipelines.api_conventions import (
     get_pipeline_path,
     PipelineConfig,
     get_api_name_from_config,
 )
+import unstructured_api_tools.pipelines.cache as cache
 import unstructured_api_tools.pipelines.lint as lint
 
-IMPORT_PATTERN = (
-    r"(^import(\s+(\w|\.)+\s+as\s+\w+|\s+\w+)?|from\s+(\w|\.)+\s+import(\s+)?(\(|\s+\w+))"
-)
-IMPORT_RE = re.compile(IMPORT_PATTERN)
 INPUT_LINES_RE = re.compile(r"\n\n# In\[.+\]:")
 PIPELINE_API_RE = re.compile(r"\n\n# pipeline-api")
 HEADERS_RE = re.compile(r"#(!/usr/bin/env python| coding: utf-8)")
@@ -32,6 +34,8 @@ RESERVED_API_NAMES = ["app"]
 
 PATH = Path(__file__).resolve().parent
 TEMPLATE_PATH = os.path.join(PATH, "templates")
+CONVERSION_CACHE_SUBDIR = "scripts"
+LINT_CACHE_SUBDIR = "lint"
 
 
 def generate_pipeline_api(
@@ -40,9 +44,14 @@ def generate_pipeline_api(
     semver: Optional[str] = None,
     config_filename: Optional[str] = None,
     flake8_opts: List[str] = lint.FLAKE8_DEFAULT_OPTS,
+    lint_mode: str = "subprocess",
+    check_types: bool = True,
+    lint_cache_dir: Optional[str] = None,
 ) -> str:
     """Given the filename for a pipeline notebooks, generates the a FastAPI
-    application with the appropriate REST routes."""
+    application with the appropriate REST routes. If check_types is False, mypy is not run,
+    so that the caller can type check several modules at once with lint.check_mypy_modules.
+    If lint_cache_dir is specified, formatter and linter results are cached there."""
     notebook = read_notebook(filename)
     script, script_with_standard_imports = notebook_to_script(notebook)
     pipeline_path = get_pipeline_path(
@@ -61,8 +70,7 @@ def generate_pipeline_api(
     )
     pipeline_api_params = _infer_params_from_pipeline_api(script_with_standard_imports)
 
-    environment = Environment(loader=FileSystemLoader(TEMPLATE_PATH))
-    template = environment.get_template("pipeline_api.txt")
+    template = _get_template_environment().get_template("pipeline_api.txt")
     content = template.render(
         pipeline_path=pipeline_path,
         short_pipeline_path=short_pipeline_path,
@@ -80,14 +88,25 @@ def generate_pipeline_api(
 """
         + content
     )
-    content = lint.format_black(content)
-    content = lint.format_autoflake(content)
-    content = lint.remove_duplicate_imports(content)
-    lint.check_flake8(content, opts=flake8_opts)
-    lint.check_mypy(content)
+    content = lint.format_black(content, cache_dir=lint_cache_dir)
+    content = lint.format_autoflake(content, cache_dir=lint_cache_dir)
+    lint.check_flake8(content, opts=flake8_opts, mode=lint_mode, cache_dir=lint_cache_dir)
+    if check_types:
+        lint.check_mypy(content, mode=lint_mode, cache_dir=lint_cache_dir)
     return content
 
 
+@functools.lru_cache(maxsize=1)
+def _get_template_environment() -> Environment:
+    """Returns the Jinja environment for the API templates. The environment is built once per
+    process and keeps the templates it has compiled in memory. The compiled templates are also
+    stored in a bytecode cache in the system temp directory, so later runs skip compiling them
+    until the template files change."""
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_PATH), bytecode_cache=FileSystemBytecodeCache()
+    )
+
+
 def _infer_params_from_pipeline_api(script: str) -> Dict[str, Optional[Any]]:
     """A helper function to prepare jinja interpolation.
     Returns a list of string (multi-value) parameters to expose in the FastAPI route.
@@ -97,9 +116,12 @@ def _infer_params_from_pipeline_api(script: str) -> Dict[str, Optional[Any]]:
     elif script.count("def pipeline_api(") < 1:
         logging.warning("Function pipeline_api was not defined in the pipeline API definition.")
 
-    infer_module = imp.new_module("infer_module")
-    exec(script, infer_module.__dict__)
-    params = inspect.signature(infer_module.pipeline_api).parameters
+    signature = _parse_pipeline_api_signature(script)
+    if signature is None:
+        infer_module = imp.new_module("infer_module")
+        exec(script, infer_module.__dict__)
+        signature = inspect.signature(infer_module.pipeline_api)
+    params = signature.parameters
 
     multi_string_param_names = []
     optional_param_value_map = {}
@@ -186,6 +208,93 @@ def _infer_params_from_pipeline_api(script: str) -> Dict[str, Optional[Any]]:
     }
 
 
+# Nodes whose name attribute is bound in the enclosing scope. Match patterns were added in
+# Python 3.10
+NAMED_BINDING_NODES: Tuple[Type[ast.AST], ...] = (ast.ClassDef, ast.ExceptHandler) + tuple(
+    getattr(ast, name) for name in ["MatchAs", "MatchStar"] if hasattr(ast, name)
+)
+
+
+def _binds_pipeline_api(statement: ast.stmt) -> bool:
+    """Returns True if the module level statement binds the name pipeline_api other than as
+    a top level def, e.g. with an assignment, an import, a class, a for or with target or a
+    def nested in an if or try block. Function and class bodies are not searched, since
+    they have their own scope."""
+    nodes: List[ast.AST] = [statement]
+    while nodes:
+        node = nodes.pop()
+        name: Optional[str] = None
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            name = None if node is statement else node.name
+        elif isinstance(node, NAMED_BINDING_NODES):
+            name = getattr(node, "name")
+        elif isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            name = node.id
+        elif isinstance(node, ast.alias):
+            # from module import * can bind any name
+            name = node.asname or node.name.split(".")[0]
+        if name in ("pipeline_api", "*"):
+            return True
+        if node is statement or not isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+        ):
+            nodes.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def _parse_pipeline_api_signature(script: str) -> Optional[inspect.Signature]:
+    """Reads the signature of pipeline_api from the script without executing it, so that
+    model loading and other module level code in the notebook does not run at conversion
+    time. Returns None if the signature cannot be determined statically, i.e. if
+    pipeline_api is not defined with a module level def, is decorated, is bound by any
+    other module level statement or has a default value that is not a literal. In that
+    case the caller needs to execute the script instead."""
+    try:
+        tree = ast.parse(script)
+    except SyntaxError:
+        return None
+
+    function_defs = [
+        node
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "pipeline_api"
+    ]
+    # If pipeline_api is redefined, the last definition is the one that is used
+    if len(function_defs) == 0 or function_defs[-1].decorator_list:
+        return None
+    if any(_binds_pipeline_api(statement) for statement in tree.body):
+        return None
+    args = function_defs[-1].args
+
+    try:
+        positional_defaults = [ast.literal_eval(default) for default in args.defaults]
+        kwonly_defaults = [
+            inspect.Parameter.empty if default is None else ast.literal_eval(default)
+            for default in args.kw_defaults
+        ]
+    except ValueError:
+        return None
+
+    parameters: List[inspect.Parameter] = []
+    positional_args = [(arg, inspect.Parameter.POSITIONAL_ONLY) for arg in args.posonlyargs] + [
+        (arg, inspect.Parameter.POSITIONAL_OR_KEYWORD) for arg in args.args
+    ]
+    positional_defaults = [inspect.Parameter.empty] * (
+        len(positional_args) - len(positional_defaults)
+    ) + positional_defaults
+    for (arg, kind), default in zip(positional_args, positional_defaults):
+        parameters.append(inspect.Parameter(arg.arg, kind, default=default))
+    if args.vararg is not None:
+        parameters.append(inspect.Parameter(args.vararg.arg, inspect.Parameter.VAR_POSITIONAL))
+    for arg, default in zip(args.kwonlyargs, kwonly_defaults):
+        parameters.append(
+            inspect.Parameter(arg.arg, inspect.Parameter.KEYWORD_ONLY, default=default)
+        )
+    if args.kwarg is not None:
+        parameters.append(inspect.Parameter(args.kwarg.arg, inspect.Parameter.VAR_KEYWORD))
+    return inspect.Signature(parameters)
+
+
 def notebook_file_to_script(
     input_filename: str,
     output_directory: str,
@@ -193,18 +302,104 @@ def notebook_file_to_script(
     semver: Optional[str] = None,
     config_filename: Optional[str] = None,
     flake8_opts: List[str] = lint.FLAKE8_DEFAULT_OPTS,
-):
+    cache_dir: Optional[str] = None,
+    lint_mode: str = "subprocess",
+    check_types: bool = True,
+) -> str:
     """Converts a notebook file to a Python script and saves it to a Python script with
     the appropriate filename. Given an input file that looks like pipeline-<pipeline>.ipynb,
-    the output file is <pipeline>.py"""
+    the output file is <pipeline>.py. Returns the generated script.
+
+    If cache_dir is specified, generated scripts are cached there and regeneration is
+    skipped when the # pipeline-api cells and conversion settings have not changed. The
+    results of the formatters and linters are cached there as well, so a script that
+    generates to the same text is not formatted and linted again."""
+    script_filename = os.path.join(output_directory, get_script_filename(input_filename))
+
+    conversion_cache_dir = None
+    lint_cache_dir = None
+    cache_key = ""
+    if cache_dir:
+        conversion_cache_dir = os.path.join(cache_dir, CONVERSION_CACHE_SUBDIR)
+        lint_cache_dir = os.path.join(cache_dir, LINT_CACHE_SUBDIR)
+        cache_key = _get_conversion_cache_key(
+            input_filename,
+            pipeline_family=pipeline_family,
+            semver=semver,
+            config_filename=config_filename,
+            flake8_opts=flake8_opts,
+            check_types=check_types,
+        )
+        cached_script = cache.read_cache(conversion_cache_dir, cache_key)
+        if cached_script is not None:
+            _write_script_if_changed(script_filename, cached_script)
+            return cached_script
+
     script = generate_pipeline_api(
         input_filename,
         pipeline_family=pipeline_family,
         semver=semver,
         config_filename=config_filename,
         flake8_opts=flake8_opts,
+        lint_mode=lint_mode,
+        check_types=check_types,
+        lint_cache_dir=lint_cache_dir,
     )
-    script_filename = os.path.join(output_directory, get_script_filename(input_filename))
+    if conversion_cache_dir:
+        cache.write_cache(conversion_cache_dir, cache_key, script)
+    with open(script_filename, "w") as f:
+        f.write(script)
+    return script
+
+
+def _get_conversion_cache_key(
+    input_filename: str,
+    pipeline_family: Optional[str] = None,
+    semver: Optional[str] = None,
+    config_filename: Optional[str] = None,
+    flake8_opts: List[str] = lint.FLAKE8_DEFAULT_OPTS,
+    check_types: bool = True,
+) -> str:
+    """Builds a key that changes whenever the generated script for the notebook could change:
+    the # pipeline-api cells, the template and package versions, the pipeline paths and the
+    lint settings the script was checked with."""
+    api_notebook = get_pipeline_api_cells(read_notebook(input_filename))
+    api_cell_sources = json.dumps([cell["source"] for cell in api_notebook["cells"]])
+    pipeline_paths = [
+        get_pipeline_path(
+            filename=get_script_filename(input_filename),
+            pipeline_family=pipeline_family,
+            semver=semver,
+            config_filename=config_filename,
+            shorter=shorter,
+        )
+        for shorter in [False, True]
+    ]
+    with open(os.path.join(TEMPLATE_PATH, "pipeline_api.txt"), "r") as f:
+        template = f.read()
+
+    return cache.hash_content(
+        api_cell_sources,
+        __version__,
+        template,
+        *pipeline_paths,
+        json.dumps(flake8_opts),
+        str(check_types),
+    )
+
+
+def _read_script(script_filename: str) -> str:
+    with open(script_filename, "r") as f:
+        return f.read()
+
+
+def _write_script_if_changed(script_filename: str, script: str):
+    """Writes the script unless the file already has the same content, which leaves the
+    modification time of unchanged scripts intact."""
+    if os.path.exists(script_filename):
+        with open(script_filename, "r") as f:
+            if f.read() == script:
+                return
     with open(script_filename, "w") as f:
         f.write(script)
 
@@ -214,9 +409,13 @@ def build_root_app_module(
     output_directory: str,
     flake8_opts: List[str] = lint.FLAKE8_DEFAULT_OPTS,
     config_filename: Optional[str] = None,
-):
-    environment = Environment(loader=FileSystemLoader(TEMPLATE_PATH))
-    template = environment.get_template("pipeline_app.txt")
+    lint_mode: str = "subprocess",
+    check_types: bool = True,
+    lint_cache_dir: Optional[str] = None,
+) -> str:
+    """Builds the app.py module that includes the routers of all of the pipeline API
+    modules and returns its content."""
+    template = _get_template_environment().get_template("pipeline_app.txt")
 
     if config_filename:
         pipeline_config = PipelineConfig(filename=config_filename)
@@ -235,11 +434,11 @@ def build_root_app_module(
         version=version,
         version_name=get_api_name_from_config(config_filename),
     )
-    content = lint.format_black(content)
-    content = lint.format_autoflake(content)
-    content = lint.remove_duplicate_imports(content)
-    lint.check_flake8(content, opts=flake8_opts)
-    lint.check_mypy(content)
+    content = lint.format_black(content, cache_dir=lint_cache_dir)
+    content = lint.format_autoflake(content, cache_dir=lint_cache_dir)
+    lint.check_flake8(content, opts=flake8_opts, mode=lint_mode, cache_dir=lint_cache_dir)
+    if check_types:
+        lint.check_mypy(content, mode=lint_mode, cache_dir=lint_cache_dir)
 
     module_filepath = os.path.join(output_directory, "app.py")
     init_filepath = os.path.join(output_directory, "__init__.py")
@@ -247,6 +446,7 @@ def build_root_app_module(
         f.write(content)
     with open(init_filepath, "w") as _:
         pass
+    return content
 
 
 def convert_notebook_files_to_api(
@@ -257,23 +457,85 @@ def convert_notebook_files_to_api(
     semver: Optional[str] = None,
     config_filename: Optional[str] = None,
     flake8_opts: List[str] = lint.FLAKE8_DEFAULT_OPTS,
+    jobs: int = 1,
+    cache_dir: Optional[str] = None,
+    lint_mode: str = "subprocess",
+    changed_notebook_filenames: Optional[List[str]] = None,
+    build_app: bool = True,
 ):
     """Converts a list of notebook files to Python FastAPI scripts and saves it as
-    a FastAPI app module with the appropriate module names."""
-    for notebook_filename in notebook_filenames:
-        input_filename = os.path.join(input_directory, notebook_filename)
-        notebook_file_to_script(
-            input_filename,
+    a FastAPI app module with the appropriate module names. If jobs is greater than one,
+    the notebooks are converted concurrently in a pool of worker processes. If cache_dir
+    is specified, notebooks that have not changed since the last run are not regenerated,
+    and entries that have not been used recently are evicted from the cache afterwards.
+
+    If changed_notebook_filenames is specified, only those notebooks are converted and the
+    previously generated scripts are used for the others. If build_app is False, the
+    previously generated app.py is used as well.
+
+    The generated modules, including app.py, are type checked together in a single mypy run
+    once all of them have been written."""
+    if changed_notebook_filenames is None:
+        changed_notebook_filenames = notebook_filenames
+    input_filenames = [
+        os.path.join(input_directory, notebook_filename)
+        for notebook_filename in notebook_filenames
+        if notebook_filename in changed_notebook_filenames
+    ]
+    conversion_kwargs: Dict[str, Any] = {
+        "pipeline_family": pipeline_family,
+        "semver": semver,
+        "config_filename": config_filename,
+        "flake8_opts": flake8_opts,
+        "cache_dir": cache_dir,
+        "lint_mode": lint_mode,
+        "check_types": False,
+    }
+
+    if jobs > 1 and len(input_filenames) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(input_filenames))) as executor:
+            futures = [
+                executor.submit(
+                    notebook_file_to_script, input_filename, output_directory, **conversion_kwargs
+                )
+                for input_filename in input_filenames
+            ]
+            # Collect results in submission order so the first failing notebook is the
+            # one that gets reported, as in the serial case
+            converted_scripts = [future.result() for future in futures]
+    else:
+        converted_scripts = [
+            notebook_file_to_script(input_filename, output_directory, **conversion_kwargs)
+            for input_filename in input_filenames
+        ]
+
+    lint_cache_dir = os.path.join(cache_dir, LINT_CACHE_SUBDIR) if cache_dir else None
+    api_module_names = [get_api_name(notebook_filename) for notebook_filename in notebook_filenames]
+    modules = {
+        get_api_name(input_filename): script
+        for input_filename, script in zip(input_filenames, converted_scripts)
+    }
+    for module_name in api_module_names:
+        if module_name not in modules:
+            modules[module_name] = _read_script(os.path.join(output_directory, f"{module_name}.py"))
+
+    if build_app:
+        modules["app"] = build_root_app_module(
+            api_module_names,
             output_directory,
-            pipeline_family=pipeline_family,
-            semver=semver,
             config_filename=config_filename,
             flake8_opts=flake8_opts,
+            lint_mode=lint_mode,
+            check_types=False,
+            lint_cache_dir=lint_cache_dir,
         )
-    api_module_names = [get_api_name(notebook_filename) for notebook_filename in notebook_filenames]
-    build_root_app_module(
-        api_module_names, output_directory, config_filename=config_filename, flake8_opts=flake8_opts
-    )
+    else:
+        modules["app"] = _read_script(os.path.join(output_directory, "app.py"))
+    lint.check_mypy_modules(modules, mode=lint_mode, cache_dir=lint_cache_dir)
+
+    if cache_dir:
+        for cache_subdir in [CONVERSION_CACHE_SUBDIR, LINT_CACHE_SUBDIR]:
+            cache.evict_cache(os.path.join(cache_dir, cache_subdir))
 
 
 def read_notebook(filename: str) -> nbformat.NotebookNode:
@@ -347,48 +609,76 @@ def _cleanup_script(script: str) -> str:
 
 
 def _organize_imports(script: str) -> str:
-    """Organizes all of the import statements at the top of the script."""
-    imports: List[str] = []
-    lines: List[str] = []
+    """Organizes all of the module level import statements at the top of the script, with
+    __future__ imports first. Imports that are nested in functions, classes or conditional
+    blocks are left in place. Imports of names that an earlier import already bound to the
+    same object are dropped."""
+    tree = ast.parse(script)
     split_lines = script.split("\n")
 
-    skip: List[int] = []
-    for i, line in enumerate(split_lines):
-        if i in skip:
+    # Statements that share a line, e.g. "import os; x = 1", are left in place
+    statements_per_line = [0] * (len(split_lines) + 1)
+    for node in tree.body:
+        for lineno in range(node.lineno, _end_lineno(node) + 1):
+            statements_per_line[lineno] += 1
+
+    future_imports: List[str] = []
+    imports: List[str] = []
+    hoisted = [False] * (len(split_lines) + 1)
+    seen_aliases: Set[Tuple[str, str, Optional[str]]] = set()
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        lineno, end_lineno = node.lineno, _end_lineno(node)
+        if any(statements_per_line[i] > 1 for i in range(lineno, end_lineno + 1)):
             continue
 
-        if IMPORT_RE.search(line) is None:
-            lines.append(line)
+        import_lines = []
+        for i in range(lineno, end_lineno + 1):
+            hoisted[i] = True
+            import_lines.append(split_lines[i - 1])
+        source = _get_import_source(node)
+        aliases = [(source, alias.name, alias.asname) for alias in node.names]
+        new_aliases = [alias for alias in aliases if alias not in seen_aliases]
+        seen_aliases.update(aliases)
+        if len(new_aliases) == 0:
             continue
 
-        if line.strip().endswith("("):
-            multiline_import, length = _get_multiline_import(split_lines[i:])
-            # NOTE(robinson): Do not continue to add new lines to the reorganized
-            # scripts until we reach the end of the multiline import
-            skip.extend([i + j for j in range(length)])
-            imports.append(multiline_import)
+        if len(new_aliases) == len(aliases):
+            import_statement = "\n".join(import_lines)
+        else:
+            import_statement = _format_import(node, new_aliases)
+        if source == "from __future__":
+            future_imports.append(import_statement)
         else:
-            imports.append(line)
-    imports.append("")
+            imports.append(import_statement)
 
-    clean_script = "\n".join(imports + lines)
-    return clean_script
+    lines = [line for i, line in enumerate(split_lines, start=1) if not hoisted[i]]
+    return "\n".join(future_imports + imports + [""] + lines)
 
 
-def _get_multiline_import(lines: List[str]) -> Tuple[str, int]:
-    """Extracts a multiline import from multiple lines. The multiline import
-    should begin at the start of the list of line."""
-    if IMPORT_RE.search(lines[0]) is None:
-        raise ValueError(f"{lines[0]} should match the import regex.")
-    if not lines[0].strip().endswith("("):
-        raise ValueError(f"{lines[0]} should end in a '('")
+def _end_lineno(node: ast.stmt) -> int:
+    end_lineno = getattr(node, "end_lineno", None)
+    return node.lineno if end_lineno is None else end_lineno
 
-    for i, line in enumerate(lines):
-        if line.strip().endswith(")"):
-            end = i + 1
-            break
 
-    return "\n".join(lines[0:end]), end
+def _get_import_source(node: Union[ast.Import, ast.ImportFrom]) -> str:
+    """Returns the part of the import statement that precedes the imported names."""
+    if isinstance(node, ast.Import):
+        return "import"
+    return f"from {'.' * node.level}{node.module or ''}"
+
+
+def _format_import(
+    node: Union[ast.Import, ast.ImportFrom], aliases: List[Tuple[str, str, Optional[str]]]
+) -> str:
+    """Builds an import statement for the node that only imports the aliases."""
+    names = ", ".join(
+        name if asname is None else f"{name} as {asname}" for _, name, asname in aliases
+    )
+    if isinstance(node, ast.Import):
+        return f"import {names}"
+    return f"{_get_import_source(node)} import {names}"
 
 
 def get_script_filename(notebook_filename: str) -> str:
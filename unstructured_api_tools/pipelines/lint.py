@@ -1,9 +1,12 @@
 """Tools for linting and autoformatting generated API files."""
+import functools
+from importlib import metadata
+import json
 import os
 import re
 from subprocess import PIPE, Popen
 import tempfile
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 from autoflake import (
     check,
     filter_unused_import,
@@ -20,12 +23,41 @@ import collections
 from black import format_str, FileMode
 from autoflake import fix_code
 
+import unstructured_api_tools.pipelines.cache as cache
+
 # NOTE(robinson) - F401 is for unused imports
 FLAKE8_DEFAULT_OPTS: List[str] = ["--max-line-length", "100", "--ignore", "F401"]
 FLAKE8_PREFIX_RE = re.compile(r".+:\d+:\d+:\s")
 FLAKE8_ERROR_CODE_RE = re.compile(r"([A-Z]\d{3},?\s?)+")
 
 MYPY_PREFIX_RE = re.compile(r".+:\d+:\s")
+MYPY_MODULE_ERROR_RE = re.compile(r"^(?P<path>.+\.py):(?P<message>\d+:\s.*)$")
+MYPY_PACKAGE_NAME = "api"
+MYPY_DEFAULT_OPTS: List[str] = ["--ignore-missing-imports", "--implicit-optional"]
+
+# "subprocess" runs each linter in a fresh interpreter. "in-process" calls the flake8
+# legacy API and mypy.api directly, which avoids paying interpreter startup and import time
+# for every file that is checked. "dmypy" runs flake8 in-process and type checks through a
+# mypy daemon that stays running between conversions, so repeated checks reuse its warm cache.
+LINT_MODES: List[str] = ["subprocess", "in-process", "dmypy"]
+DMYPY_DIR = ".unstructured_api_tools_dmypy"
+DMYPY_STATUS_FILE = os.path.join(DMYPY_DIR, "status.json")
+# Flake8 options that take a comma separated list of values
+FLAKE8_LIST_OPTS: List[str] = [
+    "select",
+    "ignore",
+    "extend_select",
+    "extend_ignore",
+    "per_file_ignores",
+    "exclude",
+    "extend_exclude",
+]
+
+# Lint results are cached per version of these tools, since upgrading any of them can change
+# the formatted output or the errors that are reported
+LINT_CACHE_TOOLS: List[str] = ["autoflake", "black", "flake8", "mypy", "pyflakes"]
+
+T = TypeVar("T")
 
 
 class LintError(RuntimeError):
@@ -45,34 +77,164 @@ def _create_file_for_user_debugging(content: str, filename: str):
         f.write(content)
 
 
-def _run_lint_cmd(cmd: List[str], filename: str, prefix_re: re.Pattern):
-    """Runs a subprocess with the specified lint command and raises a LintError
-    if the file does not pass."""
+@functools.lru_cache(maxsize=1)
+def _get_lint_tool_versions() -> str:
+    """Returns the installed versions of the lint tools as a single string."""
+    versions = []
+    for tool in LINT_CACHE_TOOLS:
+        try:
+            versions.append(f"{tool}=={metadata.version(tool)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{tool}==missing")
+    return ",".join(versions)
+
+
+def _memoize(cache_dir: Optional[str], name: str, key_parts: List[Any], func: Callable[[], T]) -> T:
+    """Returns the result of func, reading it from the cache in cache_dir if the same lint
+    step already ran on the same input with the same options and tool versions. Results
+    are only cached when func returns, so files that fail a check are checked again on
+    every run. If cache_dir is None, func is always called."""
+    if cache_dir is None:
+        return func()
+
+    key = cache.hash_content(name, _get_lint_tool_versions(), json.dumps(key_parts))
+    cached_result = cache.read_cache(cache_dir, key)
+    if cached_result is not None:
+        return json.loads(cached_result)
+
+    result = func()
+    cache.write_cache(cache_dir, key, json.dumps(result))
+    return result
+
+
+def _execute_lint_cmd(cmd: List[str], mode: str = "subprocess") -> Tuple[int, str]:
+    """Executes the lint command and returns its exit status and output. In subprocess mode
+    the command runs in a subprocess, in in-process mode the linter is invoked through its
+    Python API in the current interpreter. In dmypy mode, mypy commands are sent to the mypy
+    daemon, which is started if it is not running yet, and other linters run in-process."""
+    if mode == "dmypy" and cmd[0] == "mypy":
+        os.makedirs(DMYPY_DIR, exist_ok=True)
+        cmd = ["dmypy", "--status-file", DMYPY_STATUS_FILE, "run", "--"] + cmd[1:]
+    elif mode != "subprocess":
+        return IN_PROCESS_LINTERS[cmd[0]](cmd[1:])
+
+    process = Popen(cmd, stdout=PIPE, stderr=PIPE)
+    stdout, _ = process.communicate()
+    return process.returncode, stdout.decode("utf-8")
+
+
+def _run_lint_cmd(cmd: List[str], filename: str, prefix_re: re.Pattern, mode: str = "subprocess"):
+    """Runs the specified lint command and raises a LintError if the file does not pass."""
     try:
-        process = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        stdout, _ = process.communicate()
+        returncode, output = _execute_lint_cmd(cmd, mode=mode)
     except Exception as e:
         # NOTE(robinson) - Catching the error ensures we clean up the temp file
         os.unlink(filename)  # NOTE(robinson) - Removes the temporary file
         raise e
 
     os.unlink(filename)  # NOTE(robinson) - Removes the temporary file
-    if process.returncode != 0:
-        err = prefix_re.sub("", stdout.decode("utf-8"))
+    if returncode != 0:
+        err = prefix_re.sub("", output)
         raise LintError("\n\n" + err)
 
     return True
 
 
-def check_flake8(file_text: str, opts: List[str] = FLAKE8_DEFAULT_OPTS) -> bool:
+def _flake8_opts_to_kwargs(opts: List[str]) -> Dict[str, object]:
+    """Converts flake8 command line options, such as ["--max-line-length", "100"], to the
+    keyword arguments accepted by the flake8 legacy API."""
+    kwargs: Dict[str, object] = {}
+    i = 0
+    while i < len(opts):
+        opt = opts[i]
+        if "=" in opt:
+            name, value = opt.split("=", 1)
+            i += 1
+        elif i + 1 < len(opts) and not opts[i + 1].startswith("-"):
+            name, value = opt, opts[i + 1]
+            i += 2
+        else:
+            kwargs[opt.lstrip("-").replace("-", "_")] = True
+            i += 1
+            continue
+
+        key = name.lstrip("-").replace("-", "_")
+        if key in FLAKE8_LIST_OPTS:
+            kwargs[key] = [item.strip() for item in value.split(",") if item.strip()]
+        elif value.isdigit():
+            kwargs[key] = int(value)
+        else:
+            kwargs[key] = value
+    return kwargs
+
+
+def _run_flake8_in_process(args: List[str]) -> Tuple[int, str]:
+    """Runs flake8 on the file in args[0] using the flake8 legacy API, with args[1:] as
+    options. Returns the number of errors and the formatted error output.
+    ref: https://flake8.pycqa.org/en/latest/user/python-api.html"""
+    from flake8.api import legacy as flake8_legacy
+    from flake8.formatting.default import Default
+
+    lines: List[str] = []
+
+    class CollectingFormatter(Default):
+        def write(self, line, source):
+            if line:
+                lines.append(line)
+
+    style_guide = flake8_legacy.get_style_guide(**_flake8_opts_to_kwargs(args[1:]))
+    style_guide.init_report(CollectingFormatter)
+    report = style_guide.check_files([args[0]])
+    return report.total_errors, "".join(f"{line}\n" for line in lines)
+
+
+def _run_mypy_in_process(args: List[str]) -> Tuple[int, str]:
+    """Runs mypy with the args using mypy.api. Returns the exit status and stdout."""
+    from mypy import api as mypy_api
+
+    stdout, _, exit_status = mypy_api.run(args)
+    return exit_status, stdout
+
+
+IN_PROCESS_LINTERS: Dict[str, Callable[[List[str]], Tuple[int, str]]] = {
+    "flake8": _run_flake8_in_process,
+    "mypy": _run_mypy_in_process,
+}
+
+
+def validate_lint_mode(mode: str) -> bool:
+    """Raises an error if the lint mode is not supported."""
+    if mode not in LINT_MODES:
+        raise ValueError(f"{mode} is an invalid lint mode. Must be one of {', '.join(LINT_MODES)}.")
+    return True
+
+
+def check_flake8(
+    file_text: str,
+    opts: List[str] = FLAKE8_DEFAULT_OPTS,
+    mode: str = "subprocess",
+    cache_dir: Optional[str] = None,
+) -> bool:
     """Runs flake8 on the text. Raises and exception if the file does
-    not pass linting. Uses subprocess because per the Flake8 docs, Flake8
-    does not have a public Python API.
+    not pass linting. By default uses subprocess because per the Flake8 docs, Flake8
+    does not have a public Python API. In in-process mode, uses the legacy API instead.
+    If cache_dir is specified, text that already passed with the same options is not
+    checked again.
     ref: https://flake8.pycqa.org/en/latest/user/python-api.html#public-python-api"""
+    validate_lint_mode(mode)
+    return _memoize(
+        cache_dir,
+        "check_flake8",
+        [file_text, opts],
+        lambda: _check_flake8(file_text, opts=opts, mode=mode),
+    )
+
+
+def _check_flake8(file_text: str, opts: List[str], mode: str) -> bool:
     tmp = _create_tempfile(file_text)
     cmd = ["flake8", tmp.name] + opts
     try:
-        _run_lint_cmd(cmd, tmp.name, MYPY_PREFIX_RE)
+        _run_lint_cmd(cmd, tmp.name, MYPY_PREFIX_RE, mode=mode)
     except Exception as e:
         debug_file = "tmp-flake8-check-pipeline-api.py"
         _create_file_for_user_debugging(file_text, debug_file)
@@ -88,12 +250,23 @@ def validate_flake8_ignore(flake8_ignore: str) -> bool:
     return True
 
 
-def check_mypy(file_text: str):
-    """Runs mypy type checking on the file text."""
+def check_mypy(file_text: str, mode: str = "subprocess", cache_dir: Optional[str] = None):
+    """Runs mypy type checking on the file text. If cache_dir is specified, text that
+    already passed is not checked again."""
+    validate_lint_mode(mode)
+    return _memoize(
+        cache_dir,
+        "check_mypy",
+        [file_text, MYPY_DEFAULT_OPTS],
+        lambda: _check_mypy(file_text, mode=mode),
+    )
+
+
+def _check_mypy(file_text: str, mode: str) -> bool:
     tmp = _create_tempfile(file_text)
-    cmd = ["mypy", tmp.name, "--ignore-missing-imports", "--implicit-optional"]
+    cmd = ["mypy", tmp.name] + MYPY_DEFAULT_OPTS
     try:
-        _run_lint_cmd(cmd, tmp.name, MYPY_PREFIX_RE)
+        _run_lint_cmd(cmd, tmp.name, MYPY_PREFIX_RE, mode=mode)
     except Exception as e:
         debug_file = "tmp-myp-check-pipeline-api.py"
         _create_file_for_user_debugging(file_text, debug_file)
@@ -102,6 +275,112 @@ def check_mypy(file_text: str):
     return True
 
 
+def _write_package(directory: str, modules: Dict[str, str]) -> str:
+    """Writes the modules, a mapping of module name to file text, to a package in the
+    directory and returns the path of the package."""
+    package_dir = os.path.join(directory, MYPY_PACKAGE_NAME)
+    os.makedirs(package_dir, exist_ok=True)
+    with open(os.path.join(package_dir, "__init__.py"), "w"):
+        pass
+    for module_name, file_text in modules.items():
+        with open(os.path.join(package_dir, f"{module_name}.py"), "w") as f:
+            f.write(file_text)
+    return package_dir
+
+
+def _sync_package(directory: str, modules: Dict[str, str]) -> str:
+    """Like _write_package, but only writes modules whose text changed and removes modules
+    that are no longer present. Keeping unchanged files untouched at a stable path is what
+    lets the mypy daemon skip re-checking them."""
+    package_dir = os.path.join(directory, MYPY_PACKAGE_NAME)
+    os.makedirs(package_dir, exist_ok=True)
+    filenames = {f"{module_name}.py": file_text for module_name, file_text in modules.items()}
+    filenames.setdefault("__init__.py", "")
+
+    for filename in os.listdir(package_dir):
+        if filename.endswith(".py") and filename not in filenames:
+            os.unlink(os.path.join(package_dir, filename))
+
+    for filename, file_text in filenames.items():
+        filepath = os.path.join(package_dir, filename)
+        if os.path.exists(filepath):
+            with open(filepath, "r") as f:
+                if f.read() == file_text:
+                    continue
+        with open(filepath, "w") as f:
+            f.write(file_text)
+    return package_dir
+
+
+def _group_mypy_errors_by_module(output: str) -> str:
+    """Groups mypy output lines under the name of the module they refer to."""
+    errors_by_module: Dict[str, List[str]] = {}
+    summary: List[str] = []
+    for line in output.splitlines():
+        match = MYPY_MODULE_ERROR_RE.match(line)
+        if match is None:
+            summary.append(line)
+            continue
+        module_name = os.path.basename(match.group("path"))[: -len(".py")]
+        errors_by_module.setdefault(module_name, []).append(match.group("message"))
+
+    grouped = [
+        f"{module_name}:\n" + "\n".join(errors) for module_name, errors in errors_by_module.items()
+    ]
+    return "\n\n".join(grouped + ["\n".join(summary)])
+
+
+def check_mypy_modules(
+    modules: Dict[str, str], mode: str = "subprocess", cache_dir: Optional[str] = None
+) -> bool:
+    """Runs mypy type checking on multiple modules at once. The modules, a mapping of module
+    name to file text, are checked as a single package in one mypy run, which is much faster
+    than calling check_mypy for each module because mypy only loads its stubs once. Errors
+    are reported under the name of the module that caused them. If cache_dir is specified,
+    a set of modules that already passed is not checked again."""
+    validate_lint_mode(mode)
+    return _memoize(
+        cache_dir,
+        "check_mypy_modules",
+        [sorted(modules.items()), MYPY_DEFAULT_OPTS],
+        lambda: _check_mypy_modules(modules, mode=mode),
+    )
+
+
+def _check_mypy_modules(modules: Dict[str, str], mode: str) -> bool:
+    if mode == "dmypy":
+        cmd = ["mypy", _sync_package(DMYPY_DIR, modules)] + MYPY_DEFAULT_OPTS
+        returncode, output = _execute_lint_cmd(cmd, mode=mode)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cmd = ["mypy", _write_package(tmp_dir, modules)] + MYPY_DEFAULT_OPTS
+            returncode, output = _execute_lint_cmd(cmd, mode=mode)
+
+    if returncode != 0:
+        debug_dir = "tmp_mypy_check_pipeline_api"
+        cmd[1] = _write_package(debug_dir, modules)
+        raise LintError("run the following to debug: \n" f"{' '.join(cmd)}") from LintError(
+            "\n\n" + _group_mypy_errors_by_module(output)
+        )
+    return True
+
+
+def stop_mypy_daemon() -> bool:
+    """Stops the mypy daemon used by the dmypy lint mode. Returns True if a daemon was
+    running and has been stopped, and False if no daemon was running."""
+    if not os.path.exists(DMYPY_STATUS_FILE):
+        return False
+    process = Popen(["dmypy", "--status-file", DMYPY_STATUS_FILE, "stop"], stdout=PIPE, stderr=PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        if os.path.exists(DMYPY_STATUS_FILE):
+            # The daemon is not responding, so terminate it instead
+            process = Popen(["dmypy", "--status-file", DMYPY_STATUS_FILE, "kill"], stdout=PIPE)
+            process.communicate()
+        return process.returncode == 0
+    return True
+
+
 def check_black(file_text: str) -> bool:
     """Checks if a file needs to be reformatted with black."""
     passes = format_black(file_text) == file_text
@@ -110,17 +389,27 @@ def check_black(file_text: str) -> bool:
     return passes
 
 
-def format_black(file_text: str) -> str:
+def format_black(file_text: str, cache_dir: Optional[str] = None) -> str:
     """Auto-formats a file using black."""
-    return format_str(file_text, mode=FileMode(line_length=100))
+    return _memoize(
+        cache_dir,
+        "format_black",
+        [file_text],
+        lambda: format_str(file_text, mode=FileMode(line_length=100)),
+    )
 
 
-def format_autoflake(file_text: str) -> str:
-    return fix_code(
-        source=file_text,
-        remove_unused_variables=True,
-        remove_all_unused_imports=True,
-        expand_star_imports=True,
+def format_autoflake(file_text: str, cache_dir: Optional[str] = None) -> str:
+    return _memoize(
+        cache_dir,
+        "format_autoflake",
+        [file_text],
+        lambda: fix_code(
+            source=file_text,
+            remove_unused_variables=True,
+            remove_all_unused_imports=True,
+            expand_star_imports=True,
+        ),
     )
 
 
@@ -165,5 +454,10 @@ def _remove_duplicate_imports(text: str):
         previous_line = line
 
 
-def remove_duplicate_imports(text: str) -> str:
-    return "".join(filter_useless_pass("".join(_remove_duplicate_imports(text))))
+def remove_duplicate_imports(text: str, cache_dir: Optional[str] = None) -> str:
+    return _memoize(
+        cache_dir,
+        "remove_duplicate_imports",
+        [text],
+        lambda: "".join(filter_useless_pass("".join(_remove_duplicate_imports(text)))),
+    )
@@ -0,0 +1,126 @@
+"""Tools for regenerating pipeline APIs as pipeline notebooks change."""
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from unstructured_api_tools.pipelines.api_conventions import get_config_filename
+from unstructured_api_tools.pipelines.convert import convert_notebook_files_to_api
+import unstructured_api_tools.pipelines.lint as lint
+
+# Seconds between checks of the input directory for changes
+WATCH_INTERVAL: float = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def _get_file_stat(filename: str) -> Optional[Tuple[int, int]]:
+    """Returns the modification time and size of the file, or None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_notebook_stats(input_directory: str) -> Dict[str, Tuple[int, int]]:
+    """Returns the modification time and size of each pipeline notebook in the directory."""
+    stats: Dict[str, Tuple[int, int]] = {}
+    for filename in os.listdir(input_directory):
+        if not filename.endswith(".ipynb"):
+            continue
+        stat = _get_file_stat(os.path.join(input_directory, filename))
+        if stat is not None:
+            stats[filename] = stat
+    return stats
+
+
+def get_changed_notebooks(
+    previous_stats: Dict[str, Tuple[int, int]], current_stats: Dict[str, Tuple[int, int]]
+) -> List[str]:
+    """Returns the notebooks that were added or modified between the two sets of stats."""
+    return sorted(
+        filename for filename, stat in current_stats.items() if previous_stats.get(filename) != stat
+    )
+
+
+def watch_notebook_files_to_api(
+    input_directory: str,
+    output_directory: str,
+    pipeline_family: Optional[str] = None,
+    semver: Optional[str] = None,
+    config_filename: Optional[str] = None,
+    flake8_opts: List[str] = lint.FLAKE8_DEFAULT_OPTS,
+    jobs: int = 1,
+    cache_dir: Optional[str] = None,
+    lint_mode: str = "in-process",
+    interval: float = WATCH_INTERVAL,
+):
+    """Converts the pipeline notebooks in the input directory, then polls the directory and
+    the pipeline family config for changes until interrupted. Only notebooks that were added
+    or modified are regenerated, and app.py is only rebuilt if the set of notebooks changed.
+    All of the notebooks are regenerated if the config changes, since the pipeline paths
+    depend on it. Conversion errors are logged and the watch continues.
+
+    Polling the file modification times does not rely on file system events, so it works
+    the same on every platform and on network file systems. Since the linters stay loaded
+    between rebuilds, the in-process and dmypy lint modes give the fastest rebuilds."""
+    config_path = get_config_filename(config_filename)
+    kwargs: Dict[str, Any] = {
+        "pipeline_family": pipeline_family,
+        "semver": semver,
+        "config_filename": config_filename,
+        "flake8_opts": flake8_opts,
+        "jobs": jobs,
+        "cache_dir": cache_dir,
+        "lint_mode": lint_mode,
+    }
+
+    # Starting from no notebooks makes the first pass convert all of them
+    notebook_stats: Dict[str, Tuple[int, int]] = {}
+    config_stat = _get_file_stat(config_path)
+    # Notebooks and app.py stay pending after a failed conversion, so that they are
+    # converted along with the next change
+    pending_notebooks: Set[str] = set()
+    build_app = False
+    try:
+        while True:
+            current_stats = get_notebook_stats(input_directory)
+            current_config_stat = _get_file_stat(config_path)
+            config_changed = current_config_stat != config_stat
+            modules_changed = current_stats.keys() != notebook_stats.keys()
+            if config_changed:
+                logger.info(f"{config_path} changed, regenerating all notebooks.")
+                changed_notebooks = sorted(current_stats)
+            else:
+                changed_notebooks = get_changed_notebooks(notebook_stats, current_stats)
+
+            if changed_notebooks or modules_changed or config_changed:
+                pending_notebooks = (pending_notebooks | set(changed_notebooks)) & set(
+                    current_stats
+                )
+                build_app = build_app or modules_changed or config_changed
+                logger.info(f"Converting {', '.join(sorted(pending_notebooks)) or 'app.py'}")
+                try:
+                    convert_notebook_files_to_api(
+                        sorted(current_stats),
+                        input_directory,
+                        output_directory,
+                        changed_notebook_filenames=sorted(pending_notebooks),
+                        build_app=build_app,
+                        **kwargs,
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to convert pipeline notebooks: {e}")
+                    if e.__cause__ is not None:
+                        logger.error(str(e.__cause__))
+                else:
+                    logger.info("Pipeline API is up to date.")
+                    pending_notebooks = set()
+                    build_app = False
+
+            notebook_stats = current_stats
+            config_stat = current_config_stat
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return